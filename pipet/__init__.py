@@ -4,11 +4,26 @@
 # The presence of this file turns this directory into a Python package.
 #-------------------------------------------------------------------------
 
+import sys
 from . import __version__
 __version__ = __version__.VERSION_STRING
 
 
 # Load the package namespace with the core classes and such
+from .progress import *
+from .profiling import *
 from .utility import *
+from .pedestal import *
+from .validator import *
+from .fptrace import *
+from .simulator import *
+from .multi import *
+from .sorter import *
+from .delayscan import *
+from .lor import *
+from .focal import *
 from .hal import *
-
+if sys.version_info >= (3,6):
+    from .aio import *
+if sys.version_info >= (3,8):
+    from .ring import *
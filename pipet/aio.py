@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         aio.py
+#!  @brief        Asyncio interface to pipet (Python 3.6+)
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import asyncio
+import functools
+import time
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+from .hal import pipet, C_INIT_SETTLE_S, C_DAQ_RESET_SETTLE_S, C_RATES_SETTLE_S, C_DELAY_SETTLE_S
+
+def running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError: # Python 3.6, in a coroutine this is the running loop
+        return asyncio.get_event_loop()
+
+class AsyncPipet():
+    '''Non-blocking facade of a pipet instance for asyncio applications.
+
+    Every device call runs in one dedicated executor thread, so USB access
+    stays serialized and the event loop never blocks. All the waits of the
+    blocking API (settling times, polling loops) are asyncio sleeps.
+    Operations that change the device state hold a lock, so they do not
+    interleave. rates() does not take the lock and can be called during an
+    acquisition, but it still queues behind the device call in progress
+    (e.g. a whole frame read), so it is not instantaneous.'''
+    def __init__(self,pet=None):
+        self.pet = pet if pet != None else pipet()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = None
+        self._lock_loop = None
+    @property
+    def lock(self):
+        # created in the running loop: before Python 3.10 a lock is bound to
+        # the loop current at its creation, which may not be the one used
+        loop = running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+    async def call(self,fn,*args,**kwargs):
+        '''Runs a blocking call in the device thread'''
+        loop = running_loop()
+        return await loop.run_in_executor(self.executor,functools.partial(fn,*args,**kwargs))
+    def close(self):
+        self.executor.shutdown(wait=True)
+    async def init(self,bitfile='../firmware/default.bit'):
+        '''Initializes the device and uploads the firmware'''
+        async with self.lock:
+            await self.call(self.pet.fpga.InitializeDevice,bitfile)
+            init_time = time.time()
+            await self.call(self.pet.init_buses)
+            await self._reset_daqs()
+            await self.call(self.pet.oe_init)
+            await asyncio.sleep(max(0,C_INIT_SETTLE_S-(time.time()-init_time)))
+    async def _reset_daqs(self):
+        await self.call(self.pet.reset_daqs,0)
+        await asyncio.sleep(C_DAQ_RESET_SETTLE_S)
+    async def reset_daqs(self):
+        '''Reset DAQ boards'''
+        async with self.lock:
+            await self._reset_daqs()
+    async def delay(self,steps=0,settle=C_DELAY_SETTLE_S):
+        '''Sets the delay steps between DCFD_A and DCFD_B'''
+        async with self.lock:
+            await self.call(self.pet.set_delay,steps)
+            await asyncio.sleep(settle)
+    async def osc(self,enable):
+        '''Enables the internal oscillator to the DCFD output for CW measurements'''
+        async with self.lock:
+            await self.call(self.pet.osc,enable)
+    async def rates(self,print_rates=False):
+        '''Return trigger rates'''
+        return await self.call(self.pet.rates,print_rates)
+    async def frames(self,mode='auto',events=1000,frames=None,validator=None):
+        '''Yield the frames of an acquisition as they are read (async for)'''
+        async with self.lock:
+            await self.call(self.pet.start_acquisition,mode,0)
+            try:
+                await asyncio.sleep(C_DAQ_RESET_SETTLE_S)
+                r = None
+                if frames == None:
+                    await asyncio.sleep(C_RATES_SETTLE_S)
+                    r = await self.rates()
+                for cur_events in self.pet.frame_list(mode,events,frames,r):
+                    yield await self.call(self.pet.read_frame,cur_events,validator)
+            finally:
+                await self.call(self.pet.stop_acquisition)
+    async def acquire(self,mode='auto',events=1000,frames=None,validator=None):
+        '''Acquire data either in auto, single_a, single_b or coinc mode'''
+        ret = []
+        async for frame in self.frames(mode,events,frames,validator):
+            ret.append(frame)
+        return numpy.concatenate(ret)
+    async def wait_for_trigger(self,ep,n,timeout=None,polling_time=1e-3):
+        '''Polls a trigger out, returns False on timeout'''
+        start = time.time()
+        while not await self.call(self.pet.fpga.IsTriggered,ep,n):
+            if timeout and time.time() - start > timeout:
+                return False
+            await asyncio.sleep(polling_time)
+        return True
+    async def read_word(self,daq):
+        '''Reads a word from a Daq with the req/ack handshake'''
+        async with self.lock:
+            if not await self.call(daq.dav):
+                return None
+            await self.call(daq.req,o=0,oe=1,read=False)
+            if await self.call(daq.ack):
+                raise RuntimeError('ack is high while req is low.')
+            await self.call(daq.req,o=1,read=False)
+            start = time.time()
+            while not await self.call(daq.ack):
+                if time.time() - start > daq.read_timeout_s:
+                    raise RuntimeError('Timeout: Daq didn\'t ack after req.')
+                await asyncio.sleep(daq.read_poll_interval_s)
+            rd = await self.call(daq.rd)
+            await self.call(daq.req,o=0,read=False)
+            return rd
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         delayscan.py
+#!  @brief        Pipelined coincidence delay scans
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import threading
+import numpy
+from .utility import fwhm, offset
+from .pnpparse import raw2evt, and_reduce
+
+C_MAX_CFD_DELAY_STEPS = 256
+C_DELAY_SCAN_COUNTERS = ['cfd_a','cfd_b','cnc_a','cnc_b','dly_a','dly_b']
+
+class DelayScan():
+    '''Measures the coincidence rate as a function of the DCFD delay.
+
+    With events=None only the rate counters are read at each step.
+    Otherwise events coincidences are acquired too and the counter is
+    scaled by the fraction of non-delayed events within the energy gate.
+    The analysis of a step runs in a thread while the next step is being
+    set up and acquired. Each point is appended to path as soon as it is
+    analyzed (after a header line if path is new or empty) and run()
+    appends the fit as a trailing comment line.'''
+    def __init__(self,pet,path=None,counter='cnc_a',events=None,energy=None,settle_s=2):
+        self.pet = pet
+        self.path = path
+        self.counter = counter
+        self.events = events
+        self.energy = energy
+        self.settle_s = settle_s
+        self.points = {}
+        self.error = None
+        self.result = None
+    def analyze(self,steps,rates,raw):
+        try:
+            fraction = 1.
+            if raw is not None:
+                evt = raw2evt(raw,check=False)
+                mask = and_reduce(evt['a']['dco']==0,evt['b']['dco']==0)
+                if self.energy != None:
+                    for j in ['a','b']:
+                        mask = and_reduce(mask,evt[j]['sum']>=self.energy[0],evt[j]['sum']<=self.energy[1])
+                fraction = numpy.count_nonzero(mask)/evt.size if evt.size else 0.
+            self.points[steps] = rates[self.counter]*fraction
+            if self.path != None:
+                self.write_header()
+                with open(self.path,'a') as f:
+                    f.write(' '.join(map(str,[steps]+[rates[i] for i in C_DELAY_SCAN_COUNTERS]+[fraction,self.points[steps]]))+'\n')
+        except Exception:
+            self.error = sys.exc_info()[1]
+    def write_header(self):
+        if not (os.path.isfile(self.path) and os.path.getsize(self.path)):
+            with open(self.path,'a') as f:
+                f.write('# steps '+' '.join(C_DELAY_SCAN_COUNTERS)+' fraction value\n')
+    def measure(self,steps):
+        '''Measures the given delay steps, skipping those already measured'''
+        pending = None
+        for s in steps:
+            if s in self.points or abs(s) >= C_MAX_CFD_DELAY_STEPS:
+                continue
+            self.pet.delay(s,settle=self.settle_s)
+            rates = self.pet.rates()
+            raw = self.pet.acquire('coinc',self.events) if self.events else None
+            if pending != None:
+                pending.join()
+            if self.error is not None:
+                raise self.error
+            pending = threading.Thread(target=self.analyze,args=(s,rates,raw))
+            pending.start()
+        if pending != None:
+            pending.join()
+        if self.error is not None:
+            raise self.error
+    def peak(self):
+        x, y = self.curve()
+        return int(x[numpy.argmax(y)])
+    def curve(self):
+        x = numpy.array(sorted(self.points))
+        return x, numpy.array([self.points[i] for i in x],dtype=float)
+    def run(self,steps=range(-255,256,8),fine_span=None):
+        '''Scans the coarse steps, then every step within fine_span of the peak
+
+        The fit is returned and kept in result.'''
+        self.measure(steps)
+        if fine_span:
+            p = self.peak()
+            self.measure(range(p-fine_span,p+fine_span+1))
+        self.result = self.fit()
+        if self.path != None:
+            self.write_header()
+            with open(self.path,'a') as f:
+                f.write('# fit '+' '.join('%s %s'%(k,self.result[k]) for k in sorted(self.result))+'\n')
+        return self.result
+    def fit(self):
+        '''Returns the fwhm and offset of the timing curve in delay steps'''
+        x, y = self.curve()
+        try:
+            return {'fwhm': float(fwhm(x,y)), 'offset': float(offset(x,y))}
+        except Exception:
+            return {'fwhm': None, 'offset': None}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         focal.py
+#!  @brief        Focal-plane tomography
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import numpy
+from .lor import LORHistogram
+
+C_FOCAL_CHUNK_EVENTS = 256*1024
+
+def grid_positions(nx,ny,pitch):
+    '''Returns the (n,2) crystal centers in mm of a uniform nx x ny grid, centered
+    on the detector axis and indexed like lor.crystal_index (row*nx + column)'''
+    row, col = numpy.mgrid[0:ny,0:nx]
+    return numpy.column_stack([((col-(nx-1)/2)*pitch).ravel(),((row-(ny-1)/2)*pitch).ravel()])
+
+class FocalPlaneSystem():
+    '''Geometry of the two facing detectors sampled on a stack of focal planes.
+
+    positions_a/positions_b are the crystal centers (mm) of the two heads,
+    which lie at z = -distance/2 (a) and z = +distance/2 (b). depths are
+    the z of the focal planes (mm, 0 is the midplane), each one shape
+    (ny, nx) pixels of pixel_size mm. For every crystal pair and plane the
+    pixel crossed by the line of response is computed once and kept, so
+    backprojections and MLEM iterations are only gathers and bincounts.
+    The table can be saved and reloaded to skip the setup.'''
+    def __init__(self,positions_a,positions_b,distance,depths,shape,pixel_size):
+        self.positions_a = numpy.asarray(positions_a,dtype=numpy.float64)
+        self.positions_b = numpy.asarray(positions_b,dtype=numpy.float64)
+        self.distance = float(distance)
+        self.depths = numpy.atleast_1d(numpy.asarray(depths,dtype=numpy.float64))
+        self.shape = tuple(shape)
+        self.pixel_size = float(pixel_size)
+        self.n_pairs = self.positions_a.shape[0]*self.positions_b.shape[0]
+        self.index = numpy.empty((self.depths.size,self.n_pairs),dtype=numpy.int32)
+        for p,z in enumerate(self.depths):
+            self.index[p] = self.plane_index(z)
+        self.sensitivity = self.backproject(numpy.ones(self.n_pairs))
+    def plane_index(self,z):
+        '''Pixel crossed by each line of response at depth z, -1 outside the plane'''
+        t = (z + self.distance/2)/self.distance
+        ny, nx = self.shape
+        ix = numpy.floor(((1-t)*self.positions_a[:,None,0] + t*self.positions_b[None,:,0]).ravel()/self.pixel_size + nx/2).astype(numpy.int64)
+        iy = numpy.floor(((1-t)*self.positions_a[:,None,1] + t*self.positions_b[None,:,1]).ravel()/self.pixel_size + ny/2).astype(numpy.int64)
+        return numpy.where((ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny),iy*nx + ix,-1)
+    def backproject(self,counts):
+        '''Returns the (planes, ny, nx) backprojection of per-pair counts'''
+        counts = numpy.asarray(counts,dtype=numpy.float64).ravel()
+        ny, nx = self.shape
+        image = numpy.zeros((self.depths.size,ny*nx))
+        for p in range(self.depths.size):
+            valid = self.index[p] >= 0
+            image[p] = numpy.bincount(self.index[p][valid],weights=counts[valid],minlength=ny*nx)
+        return image.reshape((self.depths.size,)+self.shape)
+    def forward(self,image):
+        '''Returns the per-pair projection of a (planes, ny, nx) image'''
+        image = numpy.asarray(image,dtype=numpy.float64).reshape(self.depths.size,-1)
+        projection = numpy.zeros(self.n_pairs)
+        for p in range(self.depths.size):
+            valid = self.index[p] >= 0
+            projection[valid] += image[p][self.index[p][valid]]
+        return projection
+    def focal_planes(self,counts,normalize=True):
+        '''Backprojects counts (e.g. LORHistogram.net()), divided by the sensitivity if normalize'''
+        image = self.backproject(numpy.clip(counts,0,None))
+        if normalize:
+            with numpy.errstate(divide='ignore',invalid='ignore'):
+                image = numpy.nan_to_num(image/self.sensitivity)
+        return image
+    def event_counts(self,evt,lut_a,lut_b=None,energy=None,chunk_events=C_FOCAL_CHUNK_EVENTS):
+        '''Per-pair net counts of coincidence events, histogrammed chunk by chunk'''
+        h = LORHistogram(lut_a,lut_b,energy=energy)
+        if (h.n_a,h.n_b) != (self.positions_a.shape[0],self.positions_b.shape[0]):
+            raise RuntimeError('Crystal lookup tables do not match the system geometry.')
+        for i in range(0,evt.size,chunk_events):
+            h.update(evt[i:i+chunk_events])
+        return h.net()
+    def mlem(self,counts,iterations=10,image=None):
+        '''Reconstructs the focal planes with MLEM from per-pair counts'''
+        counts = numpy.clip(numpy.asarray(counts,dtype=numpy.float64).ravel(),0,None)
+        if image is None:
+            image = numpy.ones((self.depths.size,)+self.shape)
+        covered = self.sensitivity > 0
+        for k in range(iterations):
+            projection = self.forward(image)
+            with numpy.errstate(divide='ignore',invalid='ignore'):
+                ratio = numpy.where(projection > 0,counts/projection,0)
+            update = self.backproject(ratio)
+            image = numpy.where(covered,image*update/numpy.where(covered,self.sensitivity,1),0)
+        return image
+    def save(self,path):
+        numpy.savez(path,positions_a=self.positions_a,positions_b=self.positions_b,distance=self.distance,
+                    depths=self.depths,shape=numpy.array(self.shape),pixel_size=self.pixel_size,
+                    index=self.index,sensitivity=self.sensitivity)
+    @classmethod
+    def load(cls,path):
+        d = numpy.load(path)
+        system = cls.__new__(cls)
+        system.positions_a = d['positions_a']
+        system.positions_b = d['positions_b']
+        system.distance = float(d['distance'])
+        system.depths = d['depths']
+        system.shape = tuple(int(i) for i in d['shape'])
+        system.pixel_size = float(d['pixel_size'])
+        system.n_pairs = system.positions_a.shape[0]*system.positions_b.shape[0]
+        system.index = d['index']
+        system.sensitivity = d['sensitivity']
+        return system
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         fptrace.py
+#!  @brief        FrontPanel call trace recording and replay
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import atexit
+import struct
+import sys
+import time
+
+C_FP_TRACE_MAGIC = b'PPTRACE1'
+# code : name, the code is what gets stored in the trace
+C_FP_TRACE_CALLS = [
+    'OpenBySerial', 'GetDeviceInfo', 'LoadDefaultPLLConfiguration', 'ConfigureFPGA', 'IsFrontPanelEnabled',
+    'UpdateWireIns', 'UpdateWireOuts', 'SetWireInValue', 'GetWireOutValue',
+    'ActivateTriggerIn', 'UpdateTriggerOuts', 'IsTriggered',
+    'WriteToPipeIn', 'ReadFromPipeOut', 'ReadFromBlockPipeOut', 'Close',
+]
+C_FP_TRACE_MAX_ARGS = 3
+# code, start time (s from the first call), duration (s), args, return code, payload bytes
+C_FP_TRACE_RECORD = struct.Struct('<Bdf%diiI'%C_FP_TRACE_MAX_ARGS)
+# FrontPanel error codes, as defined by okCFrontPanel
+C_FP_ERROR_CODES = {
+    'NoError': 0, 'Failed': -1, 'Timeout': -2, 'DoneNotHigh': -3, 'TransferError': -4,
+    'CommunicationError': -5, 'InvalidBitstream': -6, 'FileError': -7, 'DeviceNotOpen': -8,
+    'InvalidEndpoint': -9, 'InvalidBlockSize': -10, 'UnsupportedFeature': -15,
+}
+
+class TraceRecord():
+    def __init__(self,name,t,dt,args,ret,payload):
+        self.name = name
+        self.t = t
+        self.dt = dt
+        self.args = args
+        self.ret = ret
+        self.payload = payload
+    def __repr__(self):
+        return '%12.6f %9.6f %s(%s) -> %d%s'%(self.t,self.dt,self.name,','.join(map(str,self.args)),self.ret,
+                                              ' [%d B]'%len(self.payload) if self.payload else '')
+
+def split_args(args):
+    '''Returns the integer arguments (buffer lengths included), the first string and the first buffer'''
+    ints, string, buf = [], None, None
+    for a in args:
+        if isinstance(a,(bytearray,memoryview)):
+            buf = a if buf is None else buf
+            ints.append(len(a))
+        elif isinstance(a,(bytes,str)):
+            string = a if string is None else string
+        elif isinstance(a,(bool,int)):
+            ints.append(int(a))
+    return ints, string, buf
+
+def read_trace(path):
+    '''Yields the TraceRecords stored in a trace file'''
+    with open(path,'rb') as f:
+        if f.read(len(C_FP_TRACE_MAGIC)) != C_FP_TRACE_MAGIC:
+            raise RuntimeError('Not a FrontPanel trace: '+path)
+        while True:
+            h = f.read(C_FP_TRACE_RECORD.size)
+            if len(h) < C_FP_TRACE_RECORD.size:
+                return
+            r = C_FP_TRACE_RECORD.unpack(h)
+            payload = f.read(r[-1])
+            n_args = C_FP_TRACE_MAX_ARGS
+            yield TraceRecord(C_FP_TRACE_CALLS[r[0]],r[1],r[2],r[3:3+n_args],r[3+n_args],payload)
+
+class TraceRecorder():
+    '''Wraps an okCFrontPanel and logs every call into a binary trace.
+
+    Pipe payloads are stored only if payloads is True, string arguments
+    (serial number, bitfile path) are always stored.'''
+    def __init__(self,xem,path,payloads=False):
+        self.xem = xem
+        self.payloads = payloads
+        self.f = open(path,'wb')
+        self.f.write(C_FP_TRACE_MAGIC)
+        self.t0 = None
+        atexit.register(self.close)
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+    def record(self,name,args,ret,t,dt):
+        if self.f.closed:
+            return
+        ints, string, buf = split_args(args)
+        ints = (ints + [0]*C_FP_TRACE_MAX_ARGS)[:C_FP_TRACE_MAX_ARGS]
+        if string is not None:
+            payload = string.encode('utf-8') if not isinstance(string,bytes) else string
+        elif buf is not None and self.payloads:
+            payload = bytes(buf)
+        else:
+            payload = b''
+        ret = int(ret) if isinstance(ret,(bool,int)) else 0
+        self.f.write(C_FP_TRACE_RECORD.pack(C_FP_TRACE_CALLS.index(name),t,dt,*(ints+[ret,len(payload)])))
+        self.f.write(payload)
+    def __getattr__(self,name):
+        attr = getattr(self.xem,name)
+        if name not in C_FP_TRACE_CALLS:
+            return attr
+        def traced(*args):
+            start = time.time()
+            if self.t0 is None:
+                self.t0 = start
+            ret = attr(*args)
+            self.record(name,args,ret,start-self.t0,time.time()-start)
+            return ret
+        return traced
+
+class ReplayFrontPanel():
+    '''Stands in for okCFrontPanel and answers from a recorded trace.
+
+    Calls must come in the recorded order (a RuntimeError is raised
+    otherwise unless strict is False). Read buffers are filled from the
+    stored payloads. A pipe read recorded without its payload raises a
+    RuntimeError, unless missing_payloads is True: then the buffer is left
+    as it is (a warning is printed once), which is enough to replay the
+    call timing but not the data. With timing=True every call lasts as
+    long as it did in the recorded session.'''
+    def __init__(self,path,timing=False,strict=True,missing_payloads=False):
+        self.path = path
+        self.timing = timing
+        self.strict = strict
+        self.missing_payloads = missing_payloads
+        self.warned = False
+        self.records = read_trace(path)
+        self.calls = 0
+        for i in C_FP_ERROR_CODES:
+            setattr(self,i,C_FP_ERROR_CODES[i])
+    def next_record(self,name):
+        for r in self.records:
+            self.calls += 1
+            if r.name == name:
+                return r
+            if self.strict:
+                raise RuntimeError('Trace mismatch at call %d: expected %s, got %s.'%(self.calls,r.name,name))
+        raise RuntimeError('Trace exhausted at call %d (%s).'%(self.calls+1,name))
+    def __getattr__(self,name):
+        if name not in C_FP_TRACE_CALLS:
+            raise AttributeError(name)
+        def replayed(*args):
+            r = self.next_record(name)
+            if self.timing:
+                time.sleep(r.dt)
+            buf = split_args(args)[2]
+            if buf is not None and not name.startswith('Write'):
+                if r.payload:
+                    n = min(len(buf),len(r.payload))
+                    buf[:n] = r.payload[:n]
+                elif r.ret > 0:
+                    self.missing_payload(name)
+            if name in ['IsFrontPanelEnabled','IsTriggered']:
+                return bool(r.ret)
+            return r.ret
+        return replayed
+    def missing_payload(self,name):
+        if not self.missing_payloads:
+            raise RuntimeError('No payload for %s at call %d: record the trace with payloads to replay the data.'%(name,self.calls))
+        if not self.warned:
+            print('Warning! Trace %s has no pipe payloads, the data read is not replayed.'%self.path,file=sys.stderr)
+            self.warned = True
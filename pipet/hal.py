@@ -37,15 +37,25 @@ import sys
 import time
 import datetime
 import json
-import ok
+try:
+    import ok
+except ImportError:
+    ok = None # offline use: a frontpanel stand-in must be given to okDevice
 import re
 import numpy
 import itertools
 import inspect
 import traceback
 from scipy.interpolate import UnivariateSpline
-from fractions import gcd
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
 from .utility import *
+from .pedestal import PedestalEstimator
+from .fptrace import TraceRecorder
+from .delayscan import DelayScan, C_MAX_CFD_DELAY_STEPS
+from .progress import make_progress
 
 C_OK_PIPE_ERRORS = ['InvalidEndpoint','InvalidBlockSize','Failed', 'Timeout']
 C_BTPIPE_READY_DETPH = 1024
@@ -53,6 +63,10 @@ C_DAQ_EVENT_BYTES = 20
 C_READ_BUF_MAX_SIZE = 128*1024*1024 # 128 MB
 C_READ_BUF_MAX_EVENTS = ((C_READ_BUF_MAX_SIZE//C_DAQ_EVENT_BYTES)//C_BTPIPE_READY_DETPH)*C_BTPIPE_READY_DETPH
 C_PEDESTAL_AUTO_EVENTS = 4*1024*1024
+C_INIT_SETTLE_S = 2 # counters are steady 2 seconds after the initialization
+C_DAQ_RESET_SETTLE_S = 0.5
+C_RATES_SETTLE_S = 1
+C_DELAY_SETTLE_S = 2 # rate counters after a delay change
 C_WORD_SIZE = 2
 C_BUS_MAP = {
     'x' : {
@@ -172,7 +186,7 @@ C_ACQUISITION_MODE_MAP = {
 
 def make_frame_list(tot_events,frame_events):
     tot_events, frame_events = int(tot_events), int(frame_events)
-    return [frame_events]*(tot_events//frame_events)+[tot_events%frame_events]
+    return [frame_events]*(tot_events//frame_events)+([tot_events%frame_events] if tot_events%frame_events else [])
 
 C_ACQUISITION_MODE_FRAME_SCHEME = {
         'auto'    : lambda events, rates: make_frame_list(events,C_PEDESTAL_AUTO_EVENTS),
@@ -191,6 +205,39 @@ C_CONFIGURATION_MAP = {
     'block_size'     : lambda x: {'ep': 0x04, 'value': int(x)         , 'mask': 0x07ff},
 }
 
+C_OE_INIT_STATE = dict(((b,'oe',i),1) for b, i in [('x',16),('y',16),('x',18),('y',18),('x',20),('x',21),('y',21)])
+C_OSC_BUS_STATE = dict(((b,'write',i),0) for b in 'xy' for i in (16,18))
+
+C_PLAN_CACHE = {}
+
+def compile_plan(state,cache=True):
+    '''Compiles a device state into the minimal set of wire-in writes.
+
+    state maps configuration names (see C_CONFIGURATION_MAP) to their value
+    and bus bits, given as (bus, mode, bit) with mode 'oe' or 'write' (see
+    C_BUS_MAP), to 0 or 1. Returns a tuple of (ep, value, mask), one per
+    touched endpoint, to be applied with okDevice.apply_plan. Compiled plans
+    are kept in C_PLAN_CACHE unless cache is False.'''
+    key = frozenset(state.items())
+    if cache and key in C_PLAN_CACHE:
+        return C_PLAN_CACHE[key]
+    writes = {}
+    for name, x in state.items():
+        if isinstance(name,tuple):
+            bus_n, mode, i = name
+            ep, bit = C_BUS_MAP[bus_n][mode][i]
+            w = {'ep': ep, 'value': int(bool(x))<<bit, 'mask': 1<<bit}
+        else:
+            w = C_CONFIGURATION_MAP[name](x)
+        value, mask = writes.get(w['ep'],(0,0))
+        if (value ^ w['value']) & mask & w['mask']:
+            raise RuntimeError('Conflicting writes to endpoint {} in configuration plan: {}'.format(hex(w['ep']),name))
+        writes[w['ep']] = ((value & ~w['mask']) | (w['value'] & w['mask']), mask | w['mask'])
+    plan = tuple((ep,)+writes[ep] for ep in sorted(writes))
+    if cache:
+        C_PLAN_CACHE[key] = plan
+    return plan
+
 class Bus():
     def __init__(self,fpga,name):
         self.fpga = fpga
@@ -362,8 +409,15 @@ class Daq():
             return wide_signal_getter
 
 class okDevice():
-    def __init__(self,verbose=False):
+    def __init__(self,verbose=False,serial='',trace=None,trace_payloads=False,frontpanel=None):
+        '''serial: serial number of the board to open ('' for the first one)
+        trace: path of a FrontPanel call trace to record (see fptrace)
+        frontpanel: okCFrontPanel stand-in, e.g. fptrace.ReplayFrontPanel'''
         self.verbose = verbose
+        self.serial = serial
+        self.trace = trace
+        self.trace_payloads = trace_payloads
+        self.frontpanel = frontpanel
 
     def fsm_decode(self,name,code):
         if self.fsm_map == None:
@@ -386,6 +440,13 @@ class okDevice():
             print('UpdateWireIns()')
         self.xem.UpdateWireIns()
 
+    def apply_plan(self, plan, update=True):
+        '''Writes a plan from compile_plan with a single UpdateWireIns'''
+        for ep, value, mask in plan:
+            self.SetWireIn(ep,value,mask,update=False)
+        if update:
+            self.UpdateWireIns()
+
     def GetWireOut(self, ep, update=True):
         if update:
             self.UpdateWireOuts()
@@ -439,11 +500,20 @@ class okDevice():
             return self.xem.ReadFromBlockPipeOut(ep, bsize, buf)
 
     def InitializeDevice(self, bitfile):
-        self.xem = ok.okCFrontPanel()
-        if (self.xem.NoError != self.xem.OpenBySerial('')):
+        if self.frontpanel != None:
+            self.xem = self.frontpanel
+        elif ok == None:
+            raise RuntimeError("FrontPanel SDK (ok module) not available.")
+        else:
+            self.xem = ok.okCFrontPanel()
+        if self.trace != None:
+            self.xem = TraceRecorder(self.xem,self.trace,self.trace_payloads)
+        if (self.xem.NoError != self.xem.OpenBySerial(self.serial)):
+            if self.serial:
+                raise RuntimeError("Device %s could not be opened. Is it connected?"%self.serial)
             raise RuntimeError("A device could not be opened. Is one connected?")
 
-        self.devInfo = ok.okTDeviceInfo()
+        self.devInfo = ok.okTDeviceInfo() if ok != None else None
         if (self.xem.NoError != self.xem.GetDeviceInfo(self.devInfo)):
             raise RuntimeError("Unable to retrieve device information.")
 
@@ -451,7 +521,12 @@ class okDevice():
         print("Pipet learning system - University of Pisa")
         print("-"*60)
         print(datetime.datetime.now().strftime('Board initialized: %H:%M:%S %d-%m-%Y'))
-        print("    Firmware path: %s (%s)"%(bitfile,time.strftime("%d/%m/%Y %H:%M",time.localtime(os.path.getmtime(bitfile)))))
+        if self.serial:
+            print("    Serial number: %s"%self.serial)
+        if os.path.isfile(bitfile):
+            print("    Firmware path: %s (%s)"%(bitfile,time.strftime("%d/%m/%Y %H:%M",time.localtime(os.path.getmtime(bitfile)))))
+        else:
+            print("    Firmware path: %s (not found)"%bitfile)
         print("-"*60)
 
         self.xem.LoadDefaultPLLConfiguration()
@@ -478,12 +553,14 @@ class okDevice():
                 print(traceback.format_exc(),file=sys.stderr)
 
 class pipet():
-    def __init__(self):
-        '''Main instance constructor'''
-        self.fpga = okDevice(verbose=False)
+    def __init__(self,serial='',trace=None,trace_payloads=False,frontpanel=None):
+        '''Main instance constructor (see okDevice for the arguments)'''
+        self.serial = serial
+        self.fpga = okDevice(verbose=False,serial=serial,trace=trace,trace_payloads=trace_payloads,frontpanel=frontpanel)
         self.bus_array = {'x': Bus(self.fpga,'x'), 'y': Bus(self.fpga,'y')}
         self.daq1 = Daq(self.bus_array,'1')
         self.daq2 = Daq(self.bus_array,'2')
+        self.pedestal = None
     def set_bus_verbosity(self,verbosity):
         '''Changes system verbosity (for debug only)'''
         for b in self.bus_array:
@@ -492,54 +569,41 @@ class pipet():
         '''Initializes the device and uploads the firmware'''
         self.fpga.InitializeDevice(bitfile)
         init_time = time.time()
-        self.set_bus_verbosity(False)
-        self.daq1.oe_all()
-        self.daq2.oe_all()
+        self.init_buses()
         self.reset_daqs()
         self.oe_init()
-        time.sleep(2-(time.time()-init_time)) # Needs to wait 2 seconds after the initialization to make the counters steady
-    def reset_daqs(self):
+        time.sleep(max(0,C_INIT_SETTLE_S-(time.time()-init_time))) # Needs to wait 2 seconds after the initialization to make the counters steady
+    def init_buses(self):
+        '''Enable DAQ outputs (not intended for the user)'''
+        self.set_bus_verbosity(False)
+        self.configure(dict(((bus_n,'oe',bit),1) for daq in C_DAQ_MAP for bus_n, bit, mode in C_DAQ_MAP[daq].values() if mode == 'w'))
+    def reset_daqs(self,settle=C_DAQ_RESET_SETTLE_S):
         '''Reset DAQ boards'''
-        self.daq1.nclr(0)
-        self.daq2.nclr(0)
-        self.daq1.nclr(1)
-        self.daq2.nclr(1)
-        time.sleep(0.5)
+        nclr = [C_DAQ_MAP[daq]['nclr'][:2] for daq in sorted(C_DAQ_MAP)]
+        self.configure(dict(((bus_n,'write',bit),0) for bus_n, bit in nclr))
+        self.configure(dict(((bus_n,'write',bit),1) for bus_n, bit in nclr))
+        time.sleep(settle)
     def config(self,name,value,update=True):
         '''Configures FPGA registers (not intended for the user)'''
-        self.fpga.SetWireIn(update=update,**(C_CONFIGURATION_MAP[name](value)))
-    def delay(self,steps=0):
+        self.configure({name: value},update=update)
+    def configure(self,state,update=True):
+        '''Brings configuration registers and bus bits to state (see compile_plan) in one update (not intended for the user)'''
+        self.fpga.apply_plan(compile_plan(state),update=update)
+    def delay(self,steps=0,settle=C_DELAY_SETTLE_S):
         '''Sets the delay steps between DCFD_A and DCFD_B'''
-        C_MAX_CFD_DELAY_STEPS = 256
+        self.set_delay(steps)
+        time.sleep(settle)
+    def set_delay(self,steps=0):
+        '''Writes the delay registers without waiting for the counters (not intended for the user)'''
         assert(abs(steps)<C_MAX_CFD_DELAY_STEPS)
-        if steps > 0:
-            self.config('delay_a',steps,update=False)
-            self.config('delay_b',0,update=True)
-        elif steps < 0:
-            self.config('delay_a',0,update=False)
-            self.config('delay_b',-steps,update=True)
-        else:
-            self.config('delay_a',0,update=False)
-            self.config('delay_b',0,update=True)
-        time.sleep(2)
+        self.configure({'delay_a': max(steps,0), 'delay_b': max(-steps,0)})
     def oe_init(self):
         '''Enable output buses (not intended for the user)'''
-        self.bus_array['x'].oe(16,1,update=False)
-        self.bus_array['y'].oe(16,1,update=False)
-        self.bus_array['x'].oe(18,1,update=False)
-        self.bus_array['y'].oe(18,1,update=False)
-        self.bus_array['x'].oe(20,1,update=False)
-        self.bus_array['x'].oe(20,1,update=False)
-        self.bus_array['x'].oe(21,1,update=False)
-        self.bus_array['y'].oe(21,1,update=True)
+        self.configure(C_OE_INIT_STATE)
     def osc(self,enable):
         '''Enables the internal oscillator to the DCFD output for CW measurements'''
-        self.bus_array['x'].write(16,0,update=False)
-        self.bus_array['y'].write(16,0,update=False)
-        self.bus_array['x'].write(18,0,update=False)
-        self.bus_array['y'].write(18,0,update=True)
-        self.config('oscillator1_on',enable,update=False)
-        self.config('oscillator2_on',enable,update=True)
+        state = dict(C_OSC_BUS_STATE,oscillator1_on=bool(enable),oscillator2_on=bool(enable))
+        self.configure(state)
     def read_acq_pipe(self,length):
         '''Read data from internal FIFO (not intended for the user)'''
         assert(length >= C_DAQ_EVENT_BYTES)
@@ -554,26 +618,72 @@ class pipet():
             print ('Error:',[i for i in C_OK_PIPE_ERRORS if ret == getattr(self.fpga.xem,i)])
             return None
         return numpy.frombuffer(buf,dtype=numpy.uint16)
-    def acquire(self,mode='auto',events=1000,frames=None,show=False):
-        '''Acquire data either in auto, single_a, single_b or coinc mode'''
+    def start_acquisition(self,mode,settle=C_DAQ_RESET_SETTLE_S):
+        '''Reset the DAQs and start acquiring in the given mode (not intended for the user)'''
         if mode not in C_ACQUISITION_MODE_MAP:
             raise RuntimeError('Unknown acquisition mode')
-        self.reset_daqs()
+        self.reset_daqs(settle)
+        self.config('acquisition_on',0,update=True)
+        self.configure({'acquisition_on': 1, 'acquisition_mode': mode})
+    def stop_acquisition(self):
+        '''Stop acquiring (not intended for the user)'''
         self.config('acquisition_on',0,update=True)
-        self.config('acquisition_on',1,update=False)
-        self.config('acquisition_mode',mode,update=True)
-        ret = []
+    def frame_list(self,mode,events,frames=None,rates=None):
+        '''Events per frame, from the frame scheme of the mode if frames is None (not intended for the user)'''
         if frames == None:
-            time.sleep(1)
-            r = self.rates()
-            frames = C_ACQUISITION_MODE_FRAME_SCHEME[mode](events,r)
-            for cur_events in log_progress(frames,show=show):
-                ret.append(self.read_acq_pipe(cur_events*C_DAQ_EVENT_BYTES))
+            return C_ACQUISITION_MODE_FRAME_SCHEME[mode](events,rates)
+        return [events]*frames
+    def read_frame(self,events,validator=None):
+        '''Read a frame of events and validate it (not intended for the user)'''
+        frame = self.read_acq_pipe(events*C_DAQ_EVENT_BYTES)
+        if validator != None:
+            validator.update(frame)
+        return frame
+    def frames(self,mode='auto',events=1000,frames=None,show=False,validator=None):
+        '''Yield the frames of an acquisition as they are read (see acquire)
+
+        show selects the progress reporter: False, True (notebook widget),
+        'terminal', 'log' or a progress.Progress instance.'''
+        self.start_acquisition(mode)
+        progress = make_progress(show,label=mode)
+        try:
+            r = None
+            if frames == None:
+                time.sleep(C_RATES_SETTLE_S)
+                r = self.rates()
+            frame_events = self.frame_list(mode,events,frames,r)
+            progress.start(sum(frame_events))
+            for cur_events in frame_events:
+                frame = self.read_frame(cur_events,validator)
+                progress.update(cur_events,cur_events*C_DAQ_EVENT_BYTES)
+                yield frame
+        except:
+            progress.finish(False)
+            raise
         else:
-            for i in log_progress(range(frames),show=show):
-                ret.append(self.read_acq_pipe(events*C_DAQ_EVENT_BYTES))
-        self.config('acquisition_on',0,update=True)
-        return numpy.concatenate(ret)
+            progress.finish(True)
+        finally:
+            self.stop_acquisition()
+    def acquire(self,mode='auto',events=1000,frames=None,show=False,validator=None):
+        '''Acquire data either in auto, single_a, single_b or coinc mode
+
+        An EventValidator can be passed to check frames while they arrive;
+        its DataLossError stops the acquisition.'''
+        return numpy.concatenate(list(self.frames(mode,events,frames,show,validator)))
+    def measure_pedestals(self,events=C_PEDESTAL_AUTO_EVENTS,path=None,show=False):
+        '''Measure ADC pedestals in auto mode without storing the events'''
+        estimator = PedestalEstimator()
+        for frame in self.frames('auto',events,show=show):
+            estimator.update(frame)
+        if path != None:
+            estimator.save(path)
+        self.pedestal = estimator.pedestal()
+        return estimator
+    def delay_scan(self,steps=range(-255,256,8),fine_span=None,path=None,events=None,energy=None,settle=C_DELAY_SETTLE_S):
+        '''Scans the DCFD delay and fits the coincidence timing curve (see DelayScan)'''
+        scan = DelayScan(self,path=path,events=events,energy=energy,settle_s=settle)
+        scan.run(steps,fine_span)
+        return scan
     def rates(self,print_rates=False):
         '''Return trigger rates'''
         cfd_a_lsb = self.fpga.GetWireOut(0x24,update=True)
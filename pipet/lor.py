@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         lor.py
+#!  @brief        Lines-of-response histogramming
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import numpy
+from .pnpparse import raw2evt, and_reduce, or_reduce, dummy_dip
+
+def anger(sng):
+    '''Returns the Anger positions x = xa/(xa+xb), y = ya/(ya+yb) in [0,1]'''
+    xa, xb, ya, yb = [sng[i].astype(numpy.float64) for i in ['xa','xb','ya','yb']]
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        x = xa/(xa+xb)
+        y = ya/(ya+yb)
+    return numpy.nan_to_num(x), numpy.nan_to_num(y)
+
+def crystal_index(sng,lut):
+    '''Maps singles to crystal indices, -1 where no crystal is found.
+
+    lut is either a (nx, ny) tuple for a uniform grid of crystals over the
+    Anger position square (index = row*nx + column) or a 2D integer array
+    mapping position pixels (rows are y) to crystal indices, -1 for none.
+    Dummy singles and singles with no signal on one axis (xa+xb or ya+yb
+    is 0, so no Anger position) get -1.'''
+    x, y = anger(sng)
+    if isinstance(lut,tuple):
+        nx, ny = lut
+        col = numpy.clip((x*nx).astype(numpy.int64),0,nx-1)
+        row = numpy.clip((y*ny).astype(numpy.int64),0,ny-1)
+        index = row*nx + col
+    else:
+        lut = numpy.asarray(lut)
+        col = numpy.clip((x*lut.shape[1]).astype(numpy.int64),0,lut.shape[1]-1)
+        row = numpy.clip((y*lut.shape[0]).astype(numpy.int64),0,lut.shape[0]-1)
+        index = lut[row,col].astype(numpy.int64)
+    index[or_reduce(
+        sng['dip'] == dummy_dip,
+        sng['xa'].astype(numpy.int64)+sng['xb'] == 0,
+        sng['ya'].astype(numpy.int64)+sng['yb'] == 0)] = -1
+    return index
+
+def sparse_add(keys,values,other_keys,other_values):
+    '''Sums two sparse (sorted index, count) histograms'''
+    keys, inverse = numpy.unique(numpy.concatenate([keys,other_keys]),return_inverse=True)
+    return keys, numpy.bincount(inverse.ravel(),weights=numpy.concatenate([values,other_values]),minlength=keys.size).astype(numpy.int64)
+
+def crystal_count(lut):
+    if isinstance(lut,tuple):
+        return lut[0]*lut[1]
+    return int(numpy.max(lut))+1
+
+class LORHistogram():
+    '''Accumulates crystal pair counts of coincidence events.
+
+    Prompt (dco clear) and delayed (dco set) coincidences are counted
+    separately, net() subtracts the delayed ones. The pair index is
+    crystal_a*n_b + crystal_b; counts are kept in a dense array, or with
+    sparse=True as sorted (index, count) arrays for large crystal matrices.
+    Histograms with the same geometry can be merged, and saved with save()
+    to be merged across files and processes.'''
+    def __init__(self,lut_a,lut_b=None,energy=None,sparse=False):
+        self.lut_a = lut_a
+        self.lut_b = lut_a if lut_b is None else lut_b
+        self.n_a = crystal_count(self.lut_a)
+        self.n_b = crystal_count(self.lut_b)
+        self.energy = energy
+        self.sparse = sparse
+        self.events = 0
+        if sparse:
+            self.counts = dict((k,(numpy.zeros(0,dtype=numpy.int64),numpy.zeros(0,dtype=numpy.int64))) for k in ['prompts','delayed'])
+        else:
+            self.counts = dict((k,numpy.zeros(self.n_a*self.n_b,dtype=numpy.int64)) for k in ['prompts','delayed'])
+    def accumulate(self,kind,index):
+        if not self.sparse:
+            self.counts[kind] += numpy.bincount(index,minlength=self.n_a*self.n_b)
+            return
+        keys, values = numpy.unique(index,return_counts=True)
+        self.counts[kind] = sparse_add(self.counts[kind][0],self.counts[kind][1],keys,values)
+    def update(self,evt):
+        '''Adds coincidence events (raw2evt or sort_coincidences output)'''
+        ca = crystal_index(evt['a'],self.lut_a)
+        cb = crystal_index(evt['b'],self.lut_b)
+        valid = and_reduce(ca >= 0,cb >= 0)
+        if self.energy != None:
+            for j in ['a','b']:
+                valid = and_reduce(valid,evt[j]['sum'] >= self.energy[0],evt[j]['sum'] <= self.energy[1])
+        delayed = or_reduce(evt['a']['dco'] == 1,evt['b']['dco'] == 1)
+        index = ca*self.n_b + cb
+        self.accumulate('prompts',index[and_reduce(valid,numpy.logical_not(delayed))])
+        self.accumulate('delayed',index[and_reduce(valid,delayed)])
+        self.events += evt.size
+        return self
+    def update_raw(self,raw,pedestal=None):
+        '''Adds a raw frame (e.g. from pipet.frames)'''
+        return self.update(raw2evt(raw,pedestal,check=False))
+    def merge(self,other):
+        '''Adds the counts of a histogram with the same geometry'''
+        if (self.n_a,self.n_b) != (other.n_a,other.n_b):
+            raise RuntimeError('Cannot merge LOR histograms with different geometries.')
+        for k in ['prompts','delayed']:
+            if other.sparse:
+                keys, values = other.counts[k]
+            else:
+                keys = numpy.flatnonzero(other.counts[k])
+                values = other.counts[k][keys]
+            if self.sparse:
+                self.counts[k] = sparse_add(self.counts[k][0],self.counts[k][1],keys,values)
+            else:
+                numpy.add.at(self.counts[k],keys,values)
+        self.events += other.events
+        return self
+    def dense(self,kind):
+        if not self.sparse:
+            return self.counts[kind].reshape(self.n_a,self.n_b)
+        h = numpy.zeros(self.n_a*self.n_b,dtype=numpy.int64)
+        keys, values = self.counts[kind]
+        h[keys] = values
+        return h.reshape(self.n_a,self.n_b)
+    def prompts(self):
+        return self.dense('prompts')
+    def delayed(self):
+        return self.dense('delayed')
+    def net(self):
+        '''Prompts minus delayed (randoms subtracted) counts per crystal pair'''
+        return self.prompts() - self.delayed()
+    def save(self,path):
+        d = {'shape': numpy.array([self.n_a,self.n_b]), 'events': numpy.array(self.events)}
+        for k in ['prompts','delayed']:
+            d[k] = self.dense(k).ravel() if not self.sparse else numpy.zeros(0)
+            if self.sparse:
+                d[k+'_keys'], d[k+'_values'] = self.counts[k]
+        numpy.savez_compressed(path,**d)
+    @classmethod
+    def load(cls,path,lut_a,lut_b=None):
+        '''Loads a saved histogram; lut_a/lut_b must match its geometry'''
+        d = numpy.load(path)
+        h = cls(lut_a,lut_b,sparse='prompts_keys' in d)
+        if (h.n_a,h.n_b) != tuple(d['shape']):
+            raise RuntimeError('Saved LOR histogram has a different geometry.')
+        for k in ['prompts','delayed']:
+            h.counts[k] = (d[k+'_keys'],d[k+'_values']) if h.sparse else d[k]
+        h.events = int(d['events'])
+        return h
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         multi.py
+#!  @brief        Concurrent acquisition from several boards
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import json
+import struct
+import sys
+import threading
+import time
+import numpy
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+C_MERGED_MAGIC = b'PPMERGE1'
+# board index, frame number, host time at arrival, frame bytes
+C_MERGED_FRAME = struct.Struct('<HIdI')
+C_MERGED_QUEUE_FRAMES = 16
+
+class MultiAcquisition():
+    '''Runs the acquisitions of several pipet instances concurrently.
+
+    boards is a list of pipet instances (tagged by serial number) or a
+    dict {tag: pipet}. Each board is read by its own thread; the
+    FrontPanel SDK releases the GIL during pipe transfers, so the boards
+    are read in parallel. Frames are written to a single file in order of
+    arrival, each one tagged with its board (see read_merged).'''
+    def __init__(self,boards):
+        if not isinstance(boards,dict):
+            boards = dict((b.serial or 'board%d'%i,b) for i,b in enumerate(boards))
+        self.boards = boards
+        self.tags = sorted(boards)
+    def worker(self,k,q,stop,**kwargs):
+        gen = self.boards[self.tags[k]].frames(**kwargs)
+        try:
+            for n,frame in enumerate(gen):
+                q.put((k,n,time.time(),frame))
+                if stop.is_set():
+                    break
+        except Exception:
+            q.put((k,None,time.time(),sys.exc_info()[1]))
+        finally:
+            gen.close()
+            q.put((k,None,None,None))
+    def run(self,path,mode='coinc',events=1000,frames=None,validators=None):
+        '''Acquires from all boards into path, returns per-board counters.
+
+        validators is an optional {tag: EventValidator}. The first error
+        raised by a board stops all the others and is re-raised.'''
+        q = queue.Queue(C_MERGED_QUEUE_FRAMES*len(self.tags))
+        stop = threading.Event()
+        summary = dict((t,{'frames': 0, 'bytes': 0, 'pipe_errors': 0}) for t in self.tags)
+        threads = []
+        for k,t in enumerate(self.tags):
+            kwargs = {'mode': mode, 'events': events, 'frames': frames}
+            if validators != None and t in validators:
+                kwargs['validator'] = validators[t]
+            threads.append(threading.Thread(target=self.worker,args=(k,q,stop),kwargs=kwargs,name='pipet-'+t))
+        error = None
+        started = 0
+        running = 0
+        try:
+            with open(path,'wb') as f:
+                write_merged_header(f,self.tags)
+                for i in threads:
+                    i.start()
+                    started += 1
+                    running += 1
+                while running:
+                    k, n, t, frame = q.get()
+                    if n is None:
+                        if frame is None:
+                            running -= 1
+                        elif error is None:
+                            error = frame
+                            stop.set()
+                        continue
+                    s = summary[self.tags[k]]
+                    if frame is None:
+                        s['pipe_errors'] += 1
+                        continue
+                    f.write(C_MERGED_FRAME.pack(k,n,t,frame.nbytes))
+                    frame.tofile(f)
+                    s['frames'] += 1
+                    s['bytes'] += frame.nbytes
+        finally:
+            # on a write error the workers may be blocked on a full queue:
+            # stop them and drain it until every one has signed off
+            stop.set()
+            while running:
+                k, n, t, frame = q.get()
+                if n is None and frame is None:
+                    running -= 1
+            for i in threads[:started]:
+                i.join()
+        if error is not None:
+            raise error
+        return summary
+
+def write_merged_header(f,tags):
+    h = json.dumps(list(tags)).encode('utf-8')
+    f.write(C_MERGED_MAGIC)
+    f.write(struct.pack('<I',len(h)))
+    f.write(h)
+
+def read_merged(path):
+    '''Yields (tag, frame number, host time, raw words) from a merged file'''
+    with open(path,'rb') as f:
+        if f.read(len(C_MERGED_MAGIC)) != C_MERGED_MAGIC:
+            raise RuntimeError('Not a merged acquisition file: '+path)
+        tags = json.loads(f.read(struct.unpack('<I',f.read(4))[0]).decode('utf-8'))
+        while True:
+            h = f.read(C_MERGED_FRAME.size)
+            if len(h) < C_MERGED_FRAME.size:
+                return
+            k, n, t, size = C_MERGED_FRAME.unpack(h)
+            yield tags[k], n, t, numpy.frombuffer(f.read(size),dtype=numpy.uint16)
+
+def split_merged(path):
+    '''Returns {tag: raw words} with the frames of each board concatenated'''
+    frames = {}
+    for tag, n, t, raw in read_merged(path):
+        frames.setdefault(tag,[]).append(raw)
+    return dict((tag,numpy.concatenate(frames[tag])) for tag in frames)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         pedestal.py
+#!  @brief        Streaming ADC pedestal estimation
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import json
+import numpy
+from .pnpparse import raw2rows, rows_field, channels, dummy_dip, read_pedestal, adc_bins as C_PEDESTAL_ADC_BINS
+
+C_PEDESTAL_DAQS = ['a','b']
+
+class PedestalEstimator():
+    '''Accumulates per-channel ADC histograms of both DAQs frame by frame.
+
+    Only fixed-bin histograms are kept (one bin per ADC code), so memory does
+    not depend on the number of events and mean, width and median are exact.'''
+    def __init__(self):
+        self.hist = dict((j,dict((c,numpy.zeros(C_PEDESTAL_ADC_BINS,dtype=numpy.int64)) for c in channels)) for j in C_PEDESTAL_DAQS)
+    def update(self,raw):
+        '''Adds a raw frame (as returned by pipet.read_acq_pipe)'''
+        rows = raw2rows(raw)
+        for side,j in enumerate(C_PEDESTAL_DAQS):
+            valid = rows_field(rows,side,'dip') != dummy_dip
+            for c in channels:
+                self.hist[j][c] += numpy.bincount(rows_field(rows,side,c)[valid],minlength=C_PEDESTAL_ADC_BINS)
+        return self
+    def merge(self,other):
+        '''Adds the histograms of another estimator'''
+        for j in C_PEDESTAL_DAQS:
+            for c in channels:
+                self.hist[j][c] += other.hist[j][c]
+        return self
+    def statistics(self,daq,channel):
+        h = self.hist[daq][channel]
+        count = int(h.sum())
+        if count == 0:
+            return {'count': 0, 'mean': 0., 'width': 0., 'median': 0.}
+        codes = numpy.arange(h.size)
+        mean = float(numpy.dot(h,codes))/count
+        width = float(numpy.sqrt(numpy.dot(h,(codes-mean)**2)/count))
+        median = float(numpy.searchsorted(numpy.cumsum(h),(count+1)//2))
+        return {'count': count, 'mean': mean, 'width': width, 'median': median}
+    def result(self):
+        '''Returns {daq: {channel: {count, mean, width, median}}}'''
+        return dict((j,dict((c,self.statistics(j,c)) for c in channels)) for j in C_PEDESTAL_DAQS)
+    def save(self,path):
+        '''Stores the result as json (readable with read_pedestal)'''
+        with open(path,'w') as f:
+            json.dump(self.result(),f,indent=2,sort_keys=True)
+    def pedestal(self,statistic='median'):
+        '''Returns the pedestal in the form expected by raw2sng/raw2evt'''
+        r = self.result()
+        return dict((c,numpy.array([int(round(r[j][c][statistic])) for j in C_PEDESTAL_DAQS],dtype=numpy.uint16)) for c in channels)
@@ -3,6 +3,12 @@
 from __future__ import print_function
 import numpy
 import sys
+try:
+    from .progress import make_progress
+    from .profiling import StageProfiler
+except (ImportError, ValueError):
+    from progress import make_progress # run as a script
+    from profiling import StageProfiler
 
 raw_type = numpy.uint16
 raw_type_size = 2
@@ -26,6 +32,15 @@ convmap = numpy.array([('mrk',0,6,0), ('dip',0,6,6), ('dco',0,1,12), ('tb0',4,1,
                       ],dtype=convmap_field_type)
 dummy_dip = 15
 dummy_chk = 5
+profiler = StageProfiler() # profiler.enable() to time the stages below
+marker_period = 64
+adc_bins = 4096
+sum_bins = len(channels)*(adc_bins-1)+1
+stats_percentiles = [1,5,25,50,75,95,99]
+stats_chunk_events = 1024*1024
+# just what the marker checks need, to avoid materializing event_type arrays
+marker_single_type = numpy.dtype([('mrk',raw_type),('dip',raw_type),('tb0',raw_type)])
+marker_event_type = numpy.dtype([('a',marker_single_type),('b',marker_single_type)])
 
 def and_reduce(*l):
     if len(l) == 1:
@@ -70,55 +85,114 @@ def evt2str(e):
     s += ''.join([''.join([str(e[j][i]).rjust(6) for i in extended_channels]) for j in ['a','b']])
     return s
 
-def raw2evt(raw):
-    sng = raw2sng(raw)
-    evt = numpy.zeros(sng.size//2,dtype=event_type)
-    evt['a'] = sng[::2]
-    evt['b'] = sng[1::2]
-    marker_match_check = and_reduce(
+def marker_match_mask(evt):
+    return and_reduce(
         evt['a']['mrk'] != evt['b']['mrk'],
         evt['a']['dip'] != dummy_dip,
         evt['b']['dip'] != dummy_dip
         )
-    if marker_match_check.any():
-        t = numpy.nonzero(marker_match_check)[0]
-        print ('Warning! Marker match check failed (%d times, first occurrences at event %s).'%(t.size,', '.join(map(str,t[:5]+1))),file=sys.stderr)
 
-    evt_mrk = numpy.choose(evt['a']['dip'] == dummy_dip, [evt['a']['mrk'], evt['b']['mrk']])
-    marker_continuity_check = numpy.concatenate([
+def event_marker(evt):
+    return numpy.choose(evt['a']['dip'] == dummy_dip, [evt['a']['mrk'], evt['b']['mrk']])
+
+def marker_continuity_mask(evt,prev=None):
+    # prev is the last event of the previous frame, if any
+    if prev is not None:
+        evt = numpy.concatenate([numpy.atleast_1d(prev),evt])
+    evt_mrk = event_marker(evt)
+    mask = numpy.concatenate([
             [0],and_reduce(
                 (evt_mrk[1:] - evt_mrk[:-1]) != 1,
                 (evt_mrk[:-1] - evt_mrk[1:]) != 63,
                 numpy.logical_not(and_reduce(evt['a'][1:]['tb0'],evt['a'][:-1]['tb0'],evt_mrk[1:]-evt_mrk[:-1]==0)),
                 numpy.logical_not(and_reduce(evt['b'][1:]['tb0'],evt['b'][:-1]['tb0'],evt_mrk[1:]-evt_mrk[:-1]==0)),
                 )
-        ])
+        ]).astype(bool)
+    if prev is not None:
+        mask = mask[1:]
+    return mask
+
+def marker_gap_jumps(evt,gaps,prev=None):
+    # marker step at each gap, in [0,marker_period): 0 is a repeated marker
+    mrk = event_marker(evt).astype(numpy.int64)
+    prev_mrk = numpy.empty_like(mrk)
+    prev_mrk[1:] = mrk[:-1]
+    prev_mrk[0] = event_marker(numpy.atleast_1d(prev))[0] if prev is not None else mrk[0]-1
+    return (mrk[gaps]-prev_mrk[gaps]) % marker_period
+
+def signature_mask(sng):
+    ck_array = numpy.array([sng['ck%d'%i] for i in range(chk_vector.size)]).transpose().ravel()
+    return and_reduce(
+        ck_array != numpy.repeat(chk_vector.transpose(),sng.size,axis=1).transpose().ravel(),
+        ck_array != dummy_chk)
+
+def raw2evt(raw,pedestal=None,check=True):
+    sng = raw2sng(raw,pedestal,check)
+    with profiler.stage('raw2evt.events',sng.nbytes):
+        evt = numpy.zeros(sng.size//2,dtype=event_type)
+        evt['a'] = sng[::2]
+        evt['b'] = sng[1::2]
+    if not check:
+        return evt
+    with profiler.stage('raw2evt.marker_match',evt.nbytes):
+        marker_match_check = marker_match_mask(evt)
+    if marker_match_check.any():
+        t = numpy.nonzero(marker_match_check)[0]
+        print ('Warning! Marker match check failed (%d times, first occurrences at event %s).'%(t.size,', '.join(map(str,t[:5]+1))),file=sys.stderr)
+
+    with profiler.stage('raw2evt.marker_continuity',evt.nbytes):
+        marker_continuity_check = marker_continuity_mask(evt)
     if marker_continuity_check.any():
         t = numpy.nonzero(marker_continuity_check)[0]
         print ('Warning! Marker continuity check failed (%d times, first occurrences at event %s).'%(t.size,', '.join(map(str,t[:5]+1))),file=sys.stderr)
     return evt
 
-def raw2sng(raw):
+def raw2sng(raw,pedestal=None,check=True):
     step = single_type_size//raw_type_size
-    sng = numpy.zeros(raw.size//step,dtype=single_type)
-    for i in convmap:
-        sng[i['name']] = numpy.bitwise_and(numpy.right_shift(raw[i['word']::step],i['ofs']),int('1'*i['len'],2))
-    ck_array = numpy.array([sng['ck%d'%i] for i in range(chk_vector.size)]).transpose().ravel()
-    signature_check = and_reduce(
-        ck_array != numpy.repeat(chk_vector.transpose(),sng.size,axis=1).transpose().ravel(),
-        ck_array != dummy_chk)
-    if signature_check.any():
-        t = numpy.nonzero(signature_check)[0]
-        print ('Warning! Signature check failed (%d times, first occurrences at word %s).'%(t.size,', '.join(map(str,t[:5]+1))),file=sys.stderr)
-    for i in channels:
-        sng['sum'] += sng[i]
+    with profiler.stage('raw2sng.fields',raw.nbytes):
+        sng = numpy.zeros(raw.size//step,dtype=single_type)
+        valid = None
+        for i in convmap:
+            v = numpy.bitwise_and(numpy.right_shift(raw[i['word']::step],i['ofs']),int('1'*i['len'],2))
+            if pedestal != None and i['name'] in pedestal:
+                if valid is None:
+                    valid = sng['dip'] != dummy_dip # dip comes before the channels in convmap
+                subtract_pedestal(v,pedestal[i['name']],valid)
+            sng[i['name']] = v
+    if check:
+        with profiler.stage('raw2sng.signature',raw.nbytes):
+            signature_check = signature_mask(sng)
+        if signature_check.any():
+            t = numpy.nonzero(signature_check)[0]
+            print ('Warning! Signature check failed (%d times, first occurrences at word %s).'%(t.size,', '.join(map(str,t[:5]+1))),file=sys.stderr)
+    with profiler.stage('raw2sng.sum',sng.nbytes):
+        for i in channels:
+            sng['sum'] += sng[i]
     return sng
 
+def subtract_pedestal(v,ped,valid=None):
+    # v holds interleaved a/b singles, ped the per-DAQ values; clamps at 0
+    # in place and leaves the singles where valid is False (e.g. dummy words)
+    # as they are
+    ped = numpy.asarray(ped,dtype=v.dtype)
+    for k in range(ped.size):
+        w = v[k::ped.size]
+        where = True if valid is None else valid[k::ped.size]
+        numpy.maximum(w,ped[k],out=w,where=where)
+        numpy.subtract(w,ped[k],out=w,where=where)
+
+def read_pedestal(path,statistic='median'):
+    import json
+    with open(path) as f:
+        d = json.load(f)
+    return dict((c,numpy.array([int(round(d[j][c][statistic])) for j in ['a','b']],dtype=raw_type)) for c in channels)
+
 def evt2raw(evt):
-    sng = numpy.zeros(evt.size*2,dtype=single_type)
-    sng[::2]  = evt['a']
-    sng[1::2] = evt['b']
-    raw = sng2raw(sng)
+    with profiler.stage('evt2raw',evt.nbytes):
+        sng = numpy.zeros(evt.size*2,dtype=single_type)
+        sng[::2]  = evt['a']
+        sng[1::2] = evt['b']
+        raw = sng2raw(sng)
     return raw
 
 def sng2raw(sng):
@@ -129,6 +203,163 @@ def sng2raw(sng):
         raw[i['word']::step] = numpy.bitwise_or(raw[i['word']::step],numpy.left_shift(numpy.bitwise_and(sng[i['name']],int('1'*i['len'],2)),i['ofs']))
     return raw
 
+def raw2rows(raw):
+    step = event_type_size//raw_type_size
+    return raw[:(raw.size//step)*step].reshape(-1,step)
+
+def rows_field(rows,side,name):
+    # field of single 0 (a) or 1 (b) from the (N,10) raw word view
+    i = convmap[convmap['name'] == name][0]
+    word = side*(single_type_size//raw_type_size) + int(i['word'])
+    return numpy.bitwise_and(numpy.right_shift(rows[:,word],i['ofs']),(1<<int(i['len']))-1)
+
+def rows2markers(rows):
+    evt = numpy.zeros(rows.shape[0],dtype=marker_event_type)
+    for side,j in enumerate(['a','b']):
+        for i in marker_single_type.names:
+            evt[j][i] = rows_field(rows,side,i)
+    return evt
+
+def write_rows(raw,indices,f,chunk_rows=1024*1024,progress=None):
+    rows = raw2rows(raw)
+    progress = make_progress(progress,'write')
+    progress.start(indices.size)
+    close = False
+    if not hasattr(f,'write'):
+        f = open(f,'wb')
+        close = True
+    try:
+        for i in range(0,indices.size,chunk_rows):
+            with profiler.stage('write_rows',min(chunk_rows,indices.size-i)*rows.shape[1]*raw.itemsize):
+                chunk = rows[indices[i:i+chunk_rows]]
+                chunk.tofile(f)
+            progress.update(chunk.shape[0],chunk.nbytes)
+        progress.finish()
+    finally:
+        if close:
+            f.close()
+
+class StreamCounters():
+    # signature, marker match and marker continuity counters of consecutive
+    # raw frames, working on the raw rows; the last event of each frame is
+    # kept so that gaps across frame boundaries are found too
+    def reset_counters(self):
+        self.events = 0
+        self.signature_errors = 0
+        self.mismatches = 0
+        self.gaps = 0
+        self.repeats = 0
+        self.lost_events = 0
+        self.last = None
+    def count(self,rows):
+        # updates the counters, returns the marker fields of rows
+        ck = numpy.right_shift(rows.reshape(-1,chk_vector.size),13)
+        self.signature_errors += int(numpy.count_nonzero(and_reduce(ck != chk_vector,ck != dummy_chk)))
+        evt = rows2markers(rows)
+        self.mismatches += int(numpy.count_nonzero(marker_match_mask(evt)))
+        gaps = marker_continuity_mask(evt,self.last)
+        if gaps.any():
+            # lost events are a lower bound from the marker jump; a repeated
+            # marker is a duplicated word, not a loss
+            jumps = marker_gap_jumps(evt,gaps,self.last)
+            self.gaps += int(numpy.count_nonzero(gaps))
+            self.repeats += int(numpy.count_nonzero(jumps == 0))
+            self.lost_events += int(numpy.sum(jumps[jumps > 0]-1))
+        self.events += rows.shape[0]
+        self.last = evt[-1:].copy()
+        return evt
+
+class EventStatistics(StreamCounters):
+    # one-pass summary of raw frames with constant memory
+    def __init__(self):
+        self.reset_counters()
+        self.counts = dict((j,dict((k,0) for k in ['dummy','dco','flagged','tb0','tb1','tb2','tb3'])) for j in ['a','b'])
+        self.counts['any'] = {'dco': 0, 'flagged': 0}
+        self.hist = dict((j,dict((c,numpy.zeros(sum_bins if c == 'sum' else adc_bins,dtype=numpy.int64)) for c in extended_channels)) for j in ['a','b'])
+    def update(self,raw):
+        rows = raw2rows(raw)
+        if rows.shape[0] == 0:
+            return self
+        evt = self.count(rows)
+        any_dco = numpy.zeros(rows.shape[0],dtype=bool)
+        any_flag = numpy.zeros(rows.shape[0],dtype=bool)
+        for side,j in enumerate(['a','b']):
+            c = self.counts[j]
+            valid = evt[j]['dip'] != dummy_dip
+            c['dummy'] += int(rows.shape[0] - numpy.count_nonzero(valid))
+            dco = rows_field(rows,side,'dco').astype(bool)
+            flagged = numpy.zeros(rows.shape[0],dtype=bool)
+            for k in range(4):
+                tb = rows_field(rows,side,'tb%d'%k).astype(bool)
+                c['tb%d'%k] += int(numpy.count_nonzero(tb))
+                flagged |= tb
+            c['dco'] += int(numpy.count_nonzero(dco))
+            c['flagged'] += int(numpy.count_nonzero(flagged))
+            any_dco |= dco
+            any_flag |= flagged
+            total = numpy.zeros(numpy.count_nonzero(valid),dtype=numpy.int64)
+            for i in channels:
+                v = rows_field(rows,side,i)[valid]
+                total += v
+                self.hist[j][i] += numpy.bincount(v,minlength=adc_bins)
+            self.hist[j]['sum'] += numpy.bincount(total,minlength=sum_bins)
+        self.counts['any']['dco'] += int(numpy.count_nonzero(any_dco))
+        self.counts['any']['flagged'] += int(numpy.count_nonzero(any_flag))
+        return self
+    def channel_stats(self,h):
+        count = int(h.sum())
+        if count == 0:
+            return {'count': 0}
+        nz = numpy.flatnonzero(h)
+        codes = numpy.arange(h.size)
+        cum = numpy.cumsum(h)
+        r = {'count': count, 'min': int(nz[0]), 'max': int(nz[-1]), 'mean': float(numpy.dot(h,codes))/count}
+        for q in stats_percentiles:
+            r['p%d'%q] = int(numpy.searchsorted(cum,q/100.*count,'left'))
+        return r
+    def result(self):
+        fraction = lambda n: float(n)/self.events if self.events else 0.
+        r = {
+            'events': self.events,
+            'signature_errors': self.signature_errors,
+            'marker_mismatches': self.mismatches,
+            'marker_gaps': self.gaps,
+            'marker_repeats': self.repeats,
+            'lost_events': self.lost_events,
+            'delayed_fraction': fraction(self.counts['any']['dco']),
+            'flagged_fraction': fraction(self.counts['any']['flagged']),
+        }
+        for j in ['a','b']:
+            r[j] = dict((k+'_fraction',fraction(self.counts[j][k])) for k in self.counts[j])
+            r[j]['channels'] = dict((c,self.channel_stats(self.hist[j][c])) for c in extended_channels)
+        return r
+
+def file_chunks(path,beg=None,end=None,max_words=-1,chunk_events=stats_chunk_events):
+    # yields raw chunks of the event range [beg,end) without reading the whole file;
+    # like -fe, max_words counts from the start of the file
+    step = event_type_size//raw_type_size
+    beg = beg or 0
+    if max_words >= 0:
+        end = max_words//step if end == None else min(end,max_words//step)
+    with open(path,'rb') as f:
+        f.seek(beg*event_type_size)
+        n = beg
+        while end == None or n < end:
+            count = chunk_events if end == None else min(chunk_events,end-n)
+            raw = numpy.fromfile(f,dtype=raw_type,count=count*step)
+            if raw.size == 0:
+                return
+            yield raw
+            n += raw.size//step
+            if raw.size < count*step:
+                return
+
+def report_profile(dest):
+    if dest == '-':
+        sys.stderr.write(profiler.table())
+    elif dest != None:
+        profiler.dump(dest)
+
 def crop(evt,beg,end,step=1):
     if end != None:
         evt = evt[:end*step]
@@ -136,40 +367,43 @@ def crop(evt,beg,end,step=1):
         evt = evt[beg*step:]
     return evt
 
-def filter_events(evt,args):
+def filter_mask(evt,args):
+    with profiler.stage('filter_mask',evt.nbytes):
+        return _filter_mask(evt,args)
+
+def _filter_mask(evt,args):
+    mask = numpy.ones(evt.size,dtype=bool)
     if args.d == 0:
-        evt = evt[and_reduce(evt['a']['dco']==0,evt['b']['dco']==0)]
+        mask = and_reduce(mask,evt['a']['dco']==0,evt['b']['dco']==0)
     elif args.d == 1:
-        evt = evt[or_reduce(evt['a']['dco']==1,evt['b']['dco']==1)]
-    #print args.fl
+        mask = and_reduce(mask,or_reduce(evt['a']['dco']==1,evt['b']['dco']==1))
     if args.fl == 0:
-        evt = evt[
-            and_reduce(
+        mask = and_reduce(mask,
                 evt['a']['tb0']==0,evt['a']['tb1']==0,
                 evt['a']['tb2']==0,evt['a']['tb3']==0,
                 evt['b']['tb0']==0,evt['b']['tb1']==0,
                 evt['b']['tb2']==0,evt['b']['tb3']==0
                 )
-        ]
     elif args.fl == 1:
-        evt = evt[
-            or_reduce(
+        mask = and_reduce(mask,or_reduce(
                 evt['a']['tb0']==1,evt['a']['tb1']==1,
                 evt['a']['tb2']==1,evt['a']['tb3']==1,
                 evt['b']['tb0']==1,evt['b']['tb1']==1,
                 evt['b']['tb2']==1,evt['b']['tb3']==1
-                )
-        ]
-    filter_indices = numpy.ones(evt.size,dtype=numpy.bool)
+                ))
     for i in extended_channels:
         if vars(args)['l'+i] != None:
-            filter_indices = and_reduce(filter_indices,evt['a'][i] >= vars(args)['l'+i])
-            filter_indices = and_reduce(filter_indices,evt['b'][i] >= vars(args)['l'+i])
+            mask = and_reduce(mask,evt['a'][i] >= vars(args)['l'+i])
+            mask = and_reduce(mask,evt['b'][i] >= vars(args)['l'+i])
         if vars(args)['u'+i] != None:
-            filter_indices = and_reduce(filter_indices,evt['a'][i] <= vars(args)['u'+i])
-            filter_indices = and_reduce(filter_indices,evt['b'][i] <= vars(args)['u'+i])
-    evt = evt[filter_indices]
-    return evt
+            mask = and_reduce(mask,evt['a'][i] <= vars(args)['u'+i])
+            mask = and_reduce(mask,evt['b'][i] <= vars(args)['u'+i])
+    return mask
+
+def filter_events(evt,args):
+    mask = filter_mask(evt,args)
+    with profiler.stage('filter_events.select',evt.nbytes):
+        return evt[mask]
 
 if __name__ == '__main__':
     import argparse
@@ -185,24 +419,67 @@ if __name__ == '__main__':
     parser.add_argument("-be", help="End to (before filtering)", metavar="event number", action="store",type=int)
     parser.add_argument("-ab", help="Start from (after filtering)", metavar="event number", action="store",type=int)
     parser.add_argument("-ae", help="End to (after filtering)", metavar="event number", action="store",type=int)
+    parser.add_argument("-re", help="Re-encode output events instead of copying the raw words", action="store_true")
+    parser.add_argument("-progress", help="Progress reporting on stderr [none, terminal, log]", metavar="backend", action="store", choices=['none','terminal','log'], default='none')
+    parser.add_argument("-profile","--profile", help="Time each stage and print a table to stderr, or dump it as json if a file is given", metavar="json filename", action="store", nargs='?', const='-')
+    parser.add_argument("-stats","--stats", help="Print one-pass summary statistics (before filtering) as json, or write them to a file; only -fe, -bb and -be apply, and -o, -p and -ped are not allowed", metavar="json filename", action="store", nargs='?', const='-')
+    parser.add_argument("-ped", help="Subtract the pedestals stored in this file (implies -re for the output)", metavar="json filename", action="store")
     for i in extended_channels:
         parser.add_argument("-l"+i, help="Lower threshold for ADC "+i, metavar="threshold", action="store",type=int)
     for i in extended_channels:
         parser.add_argument("-u"+i, help="Upper threshold for ADC "+i, metavar="threshold", action="store",type=int)
     args = parser.parse_args()
+    if args.stats != None and (args.opath != None or args.p or args.ped != None):
+        parser.error('-stats cannot be combined with -o, -p or -ped')
+    if args.progress == 'log':
+        import logging
+        logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s')
     if args.fe == -1:
         max_bytes = -1
     else:
         max_bytes = args.fe / raw_type_size
-    raw = numpy.fromfile(args.ipath,dtype=raw_type,count=args.fe)
-    raw = crop(raw,args.bb,args.be,event_type_size/raw_type_size)
-    evt = raw2evt(raw)
-    filter_events(evt,args)
-    evt = crop(evt,args.ab,args.ae)
+    if args.profile != None:
+        profiler.enable()
+    if args.stats != None:
+        import json
+        stats = EventStatistics()
+        progress = make_progress(args.progress,'stats')
+        for raw in file_chunks(args.ipath,args.bb,args.be,args.fe):
+            with profiler.stage('stats',raw.nbytes):
+                stats.update(raw)
+            progress.update(raw.size//(event_type_size//raw_type_size),raw.nbytes)
+        progress.finish()
+        if args.stats == '-':
+            print (json.dumps(stats.result(),indent=2,sort_keys=True))
+        else:
+            with open(args.stats,'w') as f:
+                json.dump(stats.result(),f,indent=2,sort_keys=True)
+        report_profile(args.profile)
+        sys.exit(0)
+    with profiler.stage('fromfile') as stage:
+        raw = numpy.fromfile(args.ipath,dtype=raw_type,count=args.fe)
+        stage.nbytes = raw.nbytes
+    raw = crop(raw,args.bb,args.be,event_type_size//raw_type_size)
+    pedestal = None
+    if args.ped != None:
+        pedestal = read_pedestal(args.ped)
+        args.re = True
+    evt = raw2evt(raw,pedestal)
+    indices = crop(numpy.flatnonzero(filter_mask(evt,args)),args.ab,args.ae)
     if args.opath != None:
-        raw = evt2raw(evt)
-        raw.tofile(args.opath)
+        if args.re:
+            raw = evt2raw(evt[indices])
+            with profiler.stage('tofile',raw.nbytes):
+                raw.tofile(args.opath)
+        else:
+            write_rows(raw,indices,args.opath,progress=args.progress)
     if args.p:
+        evt = evt[indices]
+        progress = make_progress(args.progress,'print').start(evt.size)
         print (header())
-        for i,e in enumerate(evt):
-            print (('%d:'%(i+1)).rjust(10),evt2str(e))
+        with profiler.stage('print',evt.nbytes):
+            for i,e in enumerate(evt):
+                print (('%d:'%(i+1)).rjust(10),evt2str(e))
+                progress.update()
+        progress.finish()
+    report_profile(args.profile)
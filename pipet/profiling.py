@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         profiling.py
+#!  @brief        Stage timing and memory profiling
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import json
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class NullStage():
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        return False
+
+C_NULL_STAGE = NullStage()
+
+class Stage():
+    def __init__(self,profiler,name,nbytes):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+    def __enter__(self):
+        self.profiler.enter(self)
+        return self
+    def __exit__(self,*args):
+        self.profiler.exit(self)
+        return False
+
+class StageProfiler():
+    '''Collects wall time, peak memory and bytes processed per named stage.
+
+    Stages are used as "with profiler.stage(name,nbytes):" and may nest;
+    repeated stages are accumulated. Memory is the peak allocated (as seen
+    by tracemalloc, numpy included) above what was allocated when the
+    stage started. When disabled stage() returns a shared no-op context,
+    so instrumented code pays one method call per stage.'''
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.reset()
+    def reset(self):
+        self.stats = {}
+        self.order = []
+        self.stack = []
+    def enable(self,memory=True):
+        self.enabled = True
+        self.memory = memory and tracemalloc != None
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return self
+    def disable(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+        self.memory = False
+    def stage(self,name,nbytes=0):
+        if not self.enabled:
+            return C_NULL_STAGE
+        return Stage(self,name,nbytes)
+    def traced_peak(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc,'reset_peak'):
+            tracemalloc.reset_peak()
+        return current, peak
+    def enter(self,stage):
+        if self.memory:
+            current, peak = self.traced_peak()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak,peak)
+            stage.start_memory = current
+            stage.peak = current
+        self.stack.append(stage)
+        stage.t0 = time.time()
+    def exit(self,stage):
+        dt = time.time() - stage.t0
+        self.stack.pop()
+        peak = None
+        if self.memory:
+            stage.peak = max(stage.peak,self.traced_peak()[1])
+            peak = stage.peak - stage.start_memory
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak,stage.peak)
+        name = '.'.join([s.name for s in self.stack] + [stage.name])
+        if name not in self.stats:
+            self.stats[name] = {'stage': name, 'calls': 0, 'time_s': 0., 'peak_bytes': None, 'bytes': 0}
+            self.order.append(name)
+        s = self.stats[name]
+        s['calls'] += 1
+        s['time_s'] += dt
+        s['bytes'] += int(stage.nbytes)
+        if peak != None:
+            s['peak_bytes'] = max(s['peak_bytes'] or 0,peak)
+    def results(self):
+        '''Stage statistics in order of first completion'''
+        ret = []
+        for name in self.order:
+            s = dict(self.stats[name])
+            s['mb_per_s'] = s['bytes']/s['time_s']/1e6 if s['time_s'] > 0 and s['bytes'] else None
+            ret.append(s)
+        return ret
+    def table(self):
+        s  = '%-36s %6s %10s %12s %12s %10s\n' % ('STAGE','CALLS','TIME [s]','PEAK [MB]','BYTES [MB]','MB/s')
+        s += '-' * 91 + '\n'
+        for r in self.results():
+            s += '%-36s %6d %10.4f %12s %12.2f %10s\n' % (r['stage'],r['calls'],r['time_s'],
+                '-' if r['peak_bytes'] is None else '%.2f' % (r['peak_bytes']/1e6),r['bytes']/1e6,
+                '-' if r['mb_per_s'] is None else '%.1f' % r['mb_per_s'])
+        return s
+    def dump(self,path):
+        with open(path,'w') as f:
+            json.dump(self.results(),f,indent=2)
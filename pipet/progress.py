@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         progress.py
+#!  @brief        Progress and telemetry reporting
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import logging
+import sys
+import time
+
+C_PROGRESS_INTERVAL_S = 0.5
+C_PROGRESS_WIDGET_STEPS = 1000
+
+class Progress():
+    '''Progress reporter that reports nothing, base of the other backends.
+
+    update() counts items (events, frames...) and bytes; reports are
+    throttled to one every interval_s seconds, whatever the update rate,
+    plus a final one from finish(). Backends override report().'''
+    def __init__(self,label='',interval_s=C_PROGRESS_INTERVAL_S):
+        self.label = label
+        self.interval_s = interval_s
+        Progress.start(self)
+    def start(self,total=None):
+        self.total = total
+        self.items = 0
+        self.bytes = 0
+        self.t0 = time.time()
+        self.last = self.t0
+        return self
+    def update(self,items=1,nbytes=0):
+        self.items += items
+        self.bytes += nbytes
+        now = time.time()
+        if now - self.last >= self.interval_s:
+            self.last = now
+            self.report(self.telemetry(now))
+    def finish(self,success=True):
+        t = self.telemetry(time.time())
+        t['status'] = 'success' if success else 'failed'
+        self.report(t)
+    def telemetry(self,now):
+        elapsed = now - self.t0
+        t = {'label': self.label, 'items': self.items, 'total': self.total, 'bytes': self.bytes,
+             'elapsed_s': elapsed, 'items_per_s': self.items/elapsed if elapsed > 0 else 0.,
+             'mb_per_s': self.bytes/elapsed/1e6 if elapsed > 0 else 0.,
+             'fraction': None, 'eta_s': None, 'status': 'running'}
+        if self.total:
+            t['fraction'] = min(1.,self.items/self.total)
+            if self.items:
+                t['eta_s'] = max(0.,elapsed*(self.total-self.items)/self.items)
+        return t
+    def report(self,t):
+        pass
+
+def format_telemetry(t):
+    s = t['label'] + ': ' if t['label'] else ''
+    if t['fraction'] is not None:
+        s += '%5.1f %% ' % (100*t['fraction'])
+    s += '%d items, %.0f items/s' % (t['items'],t['items_per_s'])
+    if t['bytes']:
+        s += ', %.2f MB/s' % t['mb_per_s']
+    if t['status'] != 'running':
+        s += ', %s in %.1f s' % (t['status'],t['elapsed_s'])
+    elif t['eta_s'] is not None:
+        s += ', ETA %.0f s' % t['eta_s']
+    return s
+
+class TerminalProgress(Progress):
+    '''Rewrites a single status line on a terminal (stderr by default)'''
+    def __init__(self,label='',interval_s=C_PROGRESS_INTERVAL_S,stream=None):
+        self.stream = stream if stream != None else sys.stderr
+        Progress.__init__(self,label,interval_s)
+    def report(self,t):
+        end = '\n' if t['status'] != 'running' else ''
+        self.stream.write('\r' + format_telemetry(t).ljust(79) + end)
+        self.stream.flush()
+
+class LogProgress(Progress):
+    '''Emits key=value telemetry lines through the logging module'''
+    def __init__(self,label='',interval_s=C_PROGRESS_INTERVAL_S,logger='pipet.progress'):
+        self.logger = logging.getLogger(logger)
+        Progress.__init__(self,label,interval_s)
+    def report(self,t):
+        self.logger.info(' '.join('%s=%s' % (k,('%.3f' % t[k]) if isinstance(t[k],float) else t[k]) for k in sorted(t)))
+
+class WidgetProgress(Progress):
+    '''Jupyter progress bar (ipywidgets is imported only when used)'''
+    def start(self,total=None):
+        Progress.start(self,total)
+        from ipywidgets import IntProgress, HTML, VBox
+        from IPython.display import display
+        self.bar = IntProgress(min=0,max=C_PROGRESS_WIDGET_STEPS,value=0 if total else C_PROGRESS_WIDGET_STEPS)
+        if not total:
+            self.bar.bar_style = 'info'
+        self.html = HTML()
+        display(VBox(children=[self.html,self.bar]))
+        return self
+    def report(self,t):
+        if not hasattr(self,'bar'):
+            return
+        if t['fraction'] is not None:
+            self.bar.value = int(t['fraction']*C_PROGRESS_WIDGET_STEPS)
+        if t['status'] != 'running':
+            self.bar.bar_style = 'success' if t['status'] == 'success' else 'danger'
+        self.html.value = format_telemetry(t)
+
+C_PROGRESS_BACKENDS = {
+    'none'     : Progress,
+    'terminal' : TerminalProgress,
+    'log'      : LogProgress,
+    'widget'   : WidgetProgress,
+}
+
+def make_progress(show=False,label=''):
+    '''Returns a reporter: show may be a Progress instance, a backend name,
+    True (widget), False/None (no output) or any other string, which is
+    used as the label of a widget'''
+    if isinstance(show,Progress):
+        return show
+    if not show:
+        return Progress(label)
+    if show is True:
+        return WidgetProgress(label)
+    if show in C_PROGRESS_BACKENDS:
+        return C_PROGRESS_BACKENDS[show](label)
+    return WidgetProgress(show)
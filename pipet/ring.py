@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         ring.py
+#!  @brief        Shared-memory frame ring buffer (Python 3.8+)
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import numpy
+from multiprocessing import shared_memory
+
+C_RING_MAGIC = 0x50495045545247 # 'PIPETRG'
+C_RING_HEADER = ['magic','slots','slot_bytes','max_consumers','write_seq','closed']
+C_RING_CONSUMER = ['pid','read_seq','overruns','frames']
+C_RING_SLOTS = 16
+C_RING_SLOT_BYTES = 8*1024*1024
+C_RING_MAX_CONSUMERS = 8
+C_RING_POLL_INTERVAL_S = 1e-3
+
+class FrameRing():
+    '''Views on the ring layout inside a shared memory block.
+
+    header | slot table (seq, bytes) | consumer table | frame slots.
+    Frame sequence numbers start at 1; a slot whose seq does not match the
+    expected one is being (or has been) overwritten.'''
+    def __init__(self,shm,slots=None,slot_bytes=None,max_consumers=None):
+        self.shm = shm
+        n = len(C_RING_HEADER)
+        self.header = numpy.ndarray(n,dtype=numpy.int64,buffer=shm.buf)
+        if slots != None:
+            self.header[:] = [C_RING_MAGIC,slots,slot_bytes,max_consumers,0,0]
+        elif self.header[0] != C_RING_MAGIC:
+            raise RuntimeError('Not a pipet frame ring: '+shm.name)
+        self.slots, self.slot_bytes, self.max_consumers = [int(self.header[C_RING_HEADER.index(i)]) for i in ['slots','slot_bytes','max_consumers']]
+        ofs = self.header.nbytes
+        self.slot_table = numpy.ndarray((self.slots,2),dtype=numpy.int64,buffer=shm.buf,offset=ofs)
+        ofs += self.slot_table.nbytes
+        self.consumers = numpy.ndarray((self.max_consumers,len(C_RING_CONSUMER)),dtype=numpy.int64,buffer=shm.buf,offset=ofs)
+        ofs += self.consumers.nbytes
+        self.data = numpy.ndarray(self.slots*self.slot_bytes,dtype=numpy.uint8,buffer=shm.buf,offset=ofs)
+    @staticmethod
+    def size(slots,slot_bytes,max_consumers):
+        return 8*(len(C_RING_HEADER) + 2*slots + len(C_RING_CONSUMER)*max_consumers) + slots*slot_bytes
+    def field(self,name):
+        return int(self.header[C_RING_HEADER.index(name)])
+    def release(self):
+        # views must go before the buffer can be closed
+        del self.header, self.slot_table, self.consumers, self.data
+
+class FramePublisher():
+    '''Publishes raw frames into a shared memory ring for local consumers.
+
+    The publisher never waits for the consumers: a consumer that falls
+    more than slots frames behind loses the oldest ones (an overrun).
+
+        ring = FramePublisher('pipet-frames')
+        ring.publish_from(pet.frames('coinc',events))'''
+    def __init__(self,name=None,slots=C_RING_SLOTS,slot_bytes=C_RING_SLOT_BYTES,max_consumers=C_RING_MAX_CONSUMERS):
+        slot_bytes = (int(slot_bytes)+7)//8*8
+        self.shm = shared_memory.SharedMemory(name=name,create=True,size=FrameRing.size(slots,slot_bytes,max_consumers))
+        self.name = self.shm.name
+        self.ring = FrameRing(self.shm,slots,slot_bytes,max_consumers)
+        self.ring.consumers[:] = 0
+    def publish(self,frame):
+        '''Copies a frame into the next slot, returns its sequence number'''
+        r = self.ring
+        b = numpy.ascontiguousarray(frame).view(numpy.uint8).ravel()
+        if b.size > r.slot_bytes:
+            raise RuntimeError('Frame too large for the ring (%d > %d bytes).'%(b.size,r.slot_bytes))
+        seq = r.field('write_seq') + 1
+        slot = (seq-1) % r.slots
+        r.slot_table[slot,0] = 0
+        r.data[slot*r.slot_bytes:slot*r.slot_bytes+b.size] = b
+        r.slot_table[slot,1] = b.size
+        r.slot_table[slot,0] = seq
+        r.header[C_RING_HEADER.index('write_seq')] = seq
+        return seq
+    def publish_from(self,frames):
+        '''Publishes every frame of an iterable (e.g. pipet.frames), returns the count'''
+        n = 0
+        for frame in frames:
+            if frame is not None:
+                self.publish(frame)
+                n += 1
+        return n
+    def status(self):
+        '''Returns the lag, overruns and frames read of each attached consumer'''
+        r = self.ring
+        write_seq = r.field('write_seq')
+        ret = []
+        for i,c in enumerate(r.consumers):
+            if c[0]:
+                ret.append({'consumer': i, 'pid': int(c[0]), 'lag': write_seq-int(c[1]),
+                            'overruns': int(c[2]), 'frames': int(c[3])})
+        return ret
+    def close(self,unlink=True):
+        '''Tells the consumers that no more frames will come and frees the ring'''
+        self.ring.header[C_RING_HEADER.index('closed')] = 1
+        self.ring.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class FrameSubscriber():
+    '''Reads frames from a FramePublisher ring in another process.
+
+    read() returns (seq, frame) where frame is a read-only numpy view into
+    the shared memory. The view stays valid until the publisher wraps
+    around; valid(seq) tells whether it still was after using it.
+
+    Consumer slots are claimed without a lock (there is no lock shared by
+    unrelated processes), so subscribers must attach one at a time: start
+    them in sequence, or serialize the constructor with a lock of your own.'''
+    def __init__(self,name,start='latest',poll_interval_s=C_RING_POLL_INTERVAL_S):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name,track=False)
+        except TypeError:
+            # before Python 3.13 attaching registers the block with the resource
+            # tracker, which would unlink it when this process exits
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        self.ring = FrameRing(self.shm)
+        self.poll_interval_s = poll_interval_s
+        self.consumer = self.claim()
+        self.next_seq = 1 if start == 'oldest' else self.ring.field('write_seq') + 1
+        self.ring.consumers[self.consumer,1] = self.next_seq - 1
+    def claim(self):
+        # not atomic: attaching subscribers must be serialized (see the class)
+        pid = os.getpid()
+        for i,c in enumerate(self.ring.consumers):
+            if c[0] == 0:
+                c[:] = [pid,0,0,0]
+                return i
+        raise RuntimeError('No free consumer slot in the ring.')
+    @property
+    def lag(self):
+        return self.ring.field('write_seq') - (self.next_seq - 1)
+    @property
+    def overruns(self):
+        return int(self.ring.consumers[self.consumer,2])
+    def read(self,timeout=None):
+        '''Waits for the next frame, returns None on timeout or when the publisher closes'''
+        r = self.ring
+        start = time.time()
+        while True:
+            write_seq = r.field('write_seq')
+            if write_seq >= self.next_seq:
+                oldest = write_seq - r.slots + 2 # the slot after write_seq may be being written
+                if self.next_seq < oldest:
+                    r.consumers[self.consumer,2] += oldest - self.next_seq
+                    self.next_seq = oldest
+                slot = (self.next_seq-1) % r.slots
+                nbytes = int(r.slot_table[slot,1])
+                if r.slot_table[slot,0] == self.next_seq:
+                    seq = self.next_seq
+                    frame = r.data[slot*r.slot_bytes:slot*r.slot_bytes+nbytes].view(numpy.uint16)
+                    frame.flags.writeable = False
+                    self.next_seq += 1
+                    r.consumers[self.consumer,1] = seq
+                    r.consumers[self.consumer,3] += 1
+                    return seq, frame
+                continue
+            if r.field('closed'):
+                return None
+            if timeout != None and time.time() - start > timeout:
+                return None
+            time.sleep(self.poll_interval_s)
+    def valid(self,seq):
+        '''Whether the frame with this sequence number has not been overwritten yet'''
+        return self.ring.slot_table[(seq-1) % self.ring.slots,0] == seq
+    def __iter__(self):
+        while True:
+            ret = self.read()
+            if ret is None:
+                return
+            yield ret
+    def close(self):
+        self.ring.consumers[self.consumer] = 0
+        self.ring.release()
+        self.shm.close()
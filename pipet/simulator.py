@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         simulator.py
+#!  @brief        Simulated FrontPanel device for offline use
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import numpy
+from .fptrace import C_FP_ERROR_CODES
+from .pnpparse import single_type, channels, dummy_dip, sng2raw, event_type_size
+
+C_SIM_RATE_EPS = {'cfd_a': 0x24, 'cfd_b': 0x26, 'cnc_a': 0x28, 'cnc_b': 0x2A, 'dly_a': 0x2C, 'dly_b': 0x2E}
+C_SIM_DAQ_IDS = (1,2)
+
+class SimulatedFrontPanel():
+    '''Stands in for okCFrontPanel and behaves like a PiPET board.
+
+    Wire ins are stored, bus reads loop back the bus writes, the rate
+    counters follow a gaussian coincidence timing curve (centered at
+    timing_offset delay steps, timing_sigma wide) and pipe reads return
+    well-formed events of the selected acquisition mode with continuous
+    markers.'''
+    def __init__(self,serial='',rates=None,timing_offset=0.,timing_sigma=8.,pedestal=100,seed=None):
+        self.serial = serial
+        self.base_rates = {'cfd_a': 20000, 'cfd_b': 20000, 'cnc_a': 2000, 'cnc_b': 2000, 'dly_a': 20, 'dly_b': 20}
+        if rates != None:
+            self.base_rates.update(rates)
+        self.timing_offset = timing_offset
+        self.timing_sigma = timing_sigma
+        self.pedestal = pedestal
+        self.rng = numpy.random.RandomState(seed)
+        self.wire_in = {}
+        self.marker = 0
+        for i in C_FP_ERROR_CODES:
+            setattr(self,i,C_FP_ERROR_CODES[i])
+    def OpenBySerial(self,serial):
+        if serial and self.serial and serial != self.serial:
+            return self.DeviceNotOpen
+        return self.NoError
+    def GetDeviceInfo(self,info):
+        return self.NoError
+    def LoadDefaultPLLConfiguration(self):
+        return self.NoError
+    def ConfigureFPGA(self,bitfile):
+        return self.NoError
+    def IsFrontPanelEnabled(self):
+        return True
+    def UpdateWireIns(self):
+        pass
+    def UpdateWireOuts(self):
+        pass
+    def UpdateTriggerOuts(self):
+        pass
+    def ActivateTriggerIn(self,ep,n):
+        return self.NoError
+    def IsTriggered(self,ep,n):
+        return False
+    def SetWireInValue(self,ep,value,mask=0xffff):
+        self.wire_in[ep] = (self.wire_in.get(ep,0) & ~mask) | (value & mask)
+        return self.NoError
+    def delay(self):
+        return self.wire_in.get(0x0E,0) - self.wire_in.get(0x0F,0)
+    def rates(self):
+        r = dict(self.base_rates)
+        peak = numpy.exp(-0.5*((self.delay()-self.timing_offset)/self.timing_sigma)**2)
+        for i in ['cnc_a','cnc_b']:
+            r[i] = int(round(r[i]*peak)) + r['dly_'+i[-1]]
+        return r
+    def GetWireOutValue(self,ep):
+        r = self.rates()
+        for i in C_SIM_RATE_EPS:
+            if ep == C_SIM_RATE_EPS[i]:
+                return r[i] & 0xffff
+            if ep == C_SIM_RATE_EPS[i]+1:
+                return (r[i] >> 16) & 0xffff
+        if 0x30 <= ep <= 0x37:
+            return self.wire_in.get(ep-0x20,0)
+        return 0
+    def mode(self):
+        return (self.wire_in.get(0x00,0) >> 3) & 0x3
+    def events(self,n):
+        '''Returns n events of the current acquisition mode as raw words'''
+        sng = numpy.zeros(2*n,dtype=single_type)
+        mrk = (self.marker + numpy.arange(n)) % 64
+        self.marker = (self.marker + n) % 64
+        r = self.rates()
+        dco = self.rng.rand(n) < (r['dly_a']/max(r['cnc_a'],1) if self.mode() == 3 else 0)
+        for k,j in enumerate([sng[0::2],sng[1::2]]):
+            j['mrk'] = mrk
+            j['dip'] = C_SIM_DAQ_IDS[k]
+            j['dco'] = dco
+            energy = numpy.where(self.rng.rand(n) < 0.7, self.rng.normal(2000,150,n), self.rng.uniform(200,1800,n))
+            w = self.rng.rand(n,len(channels))
+            w /= w.sum(axis=1)[:,None]
+            for i,c in enumerate(channels):
+                j[c] = numpy.clip(self.pedestal + energy*w[:,i],0,4095)
+        if self.mode() in (1,2):
+            # single_a/single_b: the other DAQ is a dummy word
+            sng[2-self.mode()::2]['dip'] = dummy_dip
+        return sng2raw(sng)
+    def fill(self,buf):
+        n = len(buf)//event_type_size
+        buf[:n*event_type_size] = self.events(n).tobytes()
+        return len(buf)
+    def WriteToPipeIn(self,ep,buf):
+        return len(buf)
+    def ReadFromPipeOut(self,ep,buf):
+        return self.fill(buf)
+    def ReadFromBlockPipeOut(self,ep,bsize,buf):
+        return self.fill(buf)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         sorter.py
+#!  @brief        Software coincidence sorting of singles data
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+import numpy
+from .pnpparse import event_type, dummy_dip, and_reduce, marker_period as C_MARKER_PERIOD
+
+def unwrap_markers(mrk,period=C_MARKER_PERIOD):
+    '''Turns the wrapping 6-bit markers of a singles stream into a monotonic time.
+
+    Any decrease of the marker is taken as a wrap, so at most period-1
+    marker ticks may pass between two consecutive singles.'''
+    mrk = numpy.asarray(mrk,dtype=numpy.int64)
+    wraps = numpy.zeros(mrk.size,dtype=numpy.int64)
+    wraps[1:] = numpy.cumsum(numpy.diff(mrk) < 0)
+    return mrk + period*wraps
+
+def singles(evt,side):
+    '''Returns the non-dummy singles of side 'a' or 'b' of raw2evt output'''
+    s = evt[side]
+    return s[s['dip'] != dummy_dip]
+
+def energy_mask(sng,energy):
+    return and_reduce(sng['sum'] >= energy[0],sng['sum'] <= energy[1])
+
+def match_window(ta,tb,lo,hi):
+    '''Returns all the index pairs (ia, ib) with lo <= ta[ia]-tb[ib] <= hi (ta, tb sorted)'''
+    first = numpy.searchsorted(ta,tb+lo,'left')
+    n = numpy.searchsorted(ta,tb+hi,'right') - first
+    n[n < 0] = 0
+    ib = numpy.repeat(numpy.arange(tb.size),n)
+    ia = numpy.repeat(first-(numpy.cumsum(n)-n),n) + numpy.arange(ib.size)
+    return ia, ib
+
+def kill_multiples(ia,ib):
+    '''Keeps the pairs whose singles do not belong to any other pair'''
+    keep = and_reduce(numpy.bincount(ia)[ia] == 1,numpy.bincount(ib)[ib] == 1)
+    return ia[keep], ib[keep]
+
+def sort_coincidences(sng_a,sng_b,window=0,delay=None,energy=None,multiples='all',period=C_MARKER_PERIOD):
+    '''Forms coincidences between the singles of detector a and b.
+
+    sng_a and sng_b are single_type arrays in acquisition order, e.g. from
+    singles(raw2evt(raw),'a'), covering the same time span and starting in
+    the same marker period. Pairs with |t_a - t_b| <= window (in marker
+    ticks) are prompt coincidences. If delay is given, pairs within window
+    of t_a - t_b = delay are returned too, flagged with dco like the
+    hardware delayed events, as a randoms estimate. energy is an optional
+    (lower, upper) gate on the sum of each single. multiples='kill'
+    discards the singles that take part in more than one coincidence of a
+    window. The result is an event_type array sorted by time.'''
+    assert(multiples in ['all','kill'])
+    assert(delay == None or abs(delay) > 2*window)
+    ta = unwrap_markers(sng_a['mrk'],period)
+    tb = unwrap_markers(sng_b['mrk'],period)
+    if energy != None:
+        # gate after unwrapping: dropping singles must not hide marker wraps
+        ka, kb = energy_mask(sng_a,energy), energy_mask(sng_b,energy)
+        sng_a, ta = sng_a[ka], ta[ka]
+        sng_b, tb = sng_b[kb], tb[kb]
+    windows = [(0,0)]
+    if delay != None:
+        windows.append((delay,1))
+    t, evt = [], []
+    for offset, dco in windows:
+        ia, ib = match_window(ta,tb,offset-window,offset+window)
+        if multiples == 'kill' and ia.size:
+            ia, ib = kill_multiples(ia,ib)
+        e = numpy.zeros(ia.size,dtype=event_type)
+        e['a'] = sng_a[ia]
+        e['b'] = sng_b[ib]
+        if dco:
+            e['a']['dco'] = 1
+            e['b']['dco'] = 1
+        t.append(ta[ia])
+        evt.append(e)
+    t = numpy.concatenate(t)
+    return numpy.concatenate(evt)[numpy.argsort(t,kind='mergesort')]
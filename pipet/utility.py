@@ -35,65 +35,37 @@ from __future__ import print_function
 import sys
 import numpy
 from scipy.interpolate import UnivariateSpline
-from fractions import gcd
-from ipywidgets import IntProgress, HTML, VBox
-from IPython.display import display
+from functools import reduce
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+from .progress import make_progress
 
 def log_progress(sequence, every=None, size=None, show=True):
-    is_iterator = False
+    '''Yields the items of sequence while reporting progress.
+
+    show selects the reporter (see progress.make_progress). Reports are
+    throttled by time, every is accepted for compatibility and ignored.'''
     if size is None:
         try:
             size = len(sequence)
         except TypeError:
-            is_iterator = True
-    if size is not None:
-        if every is None:
-            if size <= 200:
-                every = 1
-            else:
-                every = size / 200 # every 0.5%
-    else:
-        assert every is not None, 'sequence is iterator, set every'
-
-    if is_iterator:
-        progress = IntProgress(min=0, max=1, value=1)
-        progress.bar_style = 'info'
-    else:
-        progress = IntProgress(min=0, max=size, value=0)
-    label = HTML()
-    box = VBox(children=[label, progress])
-    fixed_label = ''
-    if show:
-        display(box)
-        if isinstance(show,str):
-            fixed_label = show
-
-    index = 0
+            size = None
+    progress = make_progress(show)
+    progress.start(size)
     try:
-        for index, record in enumerate(sequence, 1):
-            if index == 1 or index % every == 0:
-                if is_iterator:
-                    label.value = '{fixed_label}{index} / ?'.format(fixed_label=fixed_label,index=index)
-                else:
-                    progress.value = index
-                    #label.value = u'{fixed_label}{index} / {size}'.format(
-                    label.value = u'{fixed_label}{index}'.format(
-                        fixed_label=fixed_label,
-                        index='%.1f %%'%(100.*index/size),
-                        #index=index,
-                        #size=size
-                    )
+        for record in sequence:
             yield record
+            progress.update()
     except:
-        progress.bar_style = 'danger'
+        progress.finish(False)
         raise
     else:
-        progress.bar_style = 'success'
-        progress.value = index
-        label.value = '{fixed_label}{result}'.format(fixed_label=fixed_label,result=str('%.1f %%'%(100.*index/size) or '?'))
+        progress.finish(True)
 
 def lcm(numbers):
-    return reduce(lambda x, y: (x*y)/gcd(x,y), numbers, 1)
+    return reduce(lambda x, y: (x*y)//gcd(x,y), numbers, 1)
 
 def fwhm(x,y):
     return numpy.diff(UnivariateSpline(x, y-y.max()/2).roots())[0]
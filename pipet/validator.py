@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#***************************************************************************
+#*                       ______   ____    __°   ______
+#*                      / ____/  /  _/   /_/   / ____/
+#*                     / /_      / /    /_/   / / __
+#*                    / __/    _/ /   _/_/   / /_/ /
+#*                   /_/      /___/  /___/   \____/
+#*
+#*    FUNCTIONAL IMAGING AND INSTRUMENTATION GROUP - UNIVERSITA' DI PISA
+#*
+#***************************************************************************
+#*
+#*  Project     : Laboratorio di Fisica Medica
+#!  @file         validator.py
+#!  @brief        Incremental event stream validation
+#*
+#*  Author(s)   : pipet contributors
+#*                see AUTHORS for complete info
+#*  License     : see LICENSE for info
+#*
+#***************************************************************************
+#*
+#*                             R e v i s i o n s
+#*
+#*--------------------------------------------------------------------------
+#*  Timestamp             Author    Version    Description
+#*--------------------------------------------------------------------------
+#*  further revisions are tagged in the git repository
+#***************************************************************************
+
+from __future__ import division
+from __future__ import print_function
+from .pnpparse import raw2rows, StreamCounters
+
+class DataLossError(RuntimeError):
+    pass
+
+class EventValidator(StreamCounters):
+    '''Checks acquisition frames one at a time.
+
+    Only the marker fields and check bits are decoded (see StreamCounters,
+    shared with the pnpparse -stats mode), since this runs between pipe
+    reads. The last event of each frame is kept so that marker continuity (and the
+    tb0 state it depends on) is checked across frame boundaries too. Lost
+    events are estimated from the marker jump at each gap, so they are a
+    lower bound when more than 63 consecutive events are missing. A gap where
+    the marker repeats (a duplicated word rather than a loss) is counted in
+    repeats and not as lost events.
+
+    Dead time is not accounted for: event words carry no timestamp, only the
+    6 bit marker, so the time the DAQs were busy cannot be recovered from the
+    stream. lost_fraction is the closest figure available here.'''
+    def __init__(self,max_lost=None,max_lost_fraction=None):
+        self.max_lost = max_lost
+        self.max_lost_fraction = max_lost_fraction
+        self.reset()
+    def reset(self):
+        self.reset_counters()
+        self.frames = 0
+        self.pipe_errors = 0
+    @property
+    def lost_fraction(self):
+        tot = self.events + self.lost_events
+        return self.lost_events/tot if tot else 0.
+    def update(self,raw):
+        '''Validates a raw frame and updates the counters.
+
+        Raises DataLossError when one of the configured limits is exceeded.'''
+        self.frames += 1
+        if raw is None:
+            self.pipe_errors += 1
+            return self
+        rows = raw2rows(raw)
+        if rows.shape[0] == 0:
+            return self
+        self.count(rows)
+        self.check_limits()
+        return self
+    def check_limits(self):
+        if self.max_lost != None and self.lost_events > self.max_lost:
+            raise DataLossError('Lost %d events (limit %d).'%(self.lost_events,self.max_lost))
+        if self.max_lost_fraction != None and self.lost_fraction > self.max_lost_fraction:
+            raise DataLossError('Lost %.2f %% of the events (limit %.2f %%).'%(100*self.lost_fraction,100*self.max_lost_fraction))
+    def summary(self):
+        return {
+                'frames': self.frames,
+                'events': self.events,
+                'pipe_errors': self.pipe_errors,
+                'signature_errors': self.signature_errors,
+                'mismatches': self.mismatches,
+                'gaps': self.gaps,
+                'repeats': self.repeats,
+                'lost_events': self.lost_events,
+                'lost_fraction': self.lost_fraction
+            }
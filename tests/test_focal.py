@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+from pipet.focal import FocalPlaneSystem, grid_positions
+
+def make_system():
+    pos = grid_positions(6,6,2.)
+    return FocalPlaneSystem(pos,pos,40.,[-10.,0.,10.],(16,16),1.)
+
+def test_forward_backproject_adjoint():
+    system = make_system()
+    rng = numpy.random.RandomState(0)
+    image = rng.rand(*((3,)+system.shape))
+    counts = rng.rand(system.n_pairs)
+    lhs = numpy.dot(system.forward(image),counts)
+    rhs = numpy.dot(image.ravel(),system.backproject(counts).ravel())
+    assert numpy.isclose(lhs,rhs)
+
+def test_mlem():
+    system = make_system()
+    truth = numpy.zeros((3,)+system.shape)
+    truth[1,6:10,5:8] = 1.
+    image = system.mlem(system.forward(truth),iterations=20)
+    assert image.shape == truth.shape
+    assert numpy.isfinite(image).all() and (image >= 0).all()
+    assert image[1,6:10,5:8].sum() > image[1].sum()/2
+
+def test_save_load(tmp_path):
+    system = make_system()
+    path = str(tmp_path/'system.npz')
+    system.save(path)
+    loaded = FocalPlaneSystem.load(path)
+    assert loaded.shape == system.shape and loaded.n_pairs == system.n_pairs
+    assert numpy.array_equal(loaded.index,system.index)
+    counts = numpy.arange(system.n_pairs,dtype=float)
+    assert numpy.array_equal(loaded.mlem(counts,3),system.mlem(counts,3))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+import pytest
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+import pipet
+from pipet import hal
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(hal.time,'sleep',lambda s: None)
+
+def record(path,payloads):
+    board = pipet.pipet(trace=path,trace_payloads=payloads,frontpanel=pipet.SimulatedFrontPanel(seed=0))
+    board.init('nofile.bit')
+    raw = board.acquire('coinc',events=5000)
+    board.fpga.xem.close()
+    return raw
+
+def replay(path,**kwargs):
+    board = pipet.pipet(frontpanel=pipet.ReplayFrontPanel(path,**kwargs))
+    board.init('nofile.bit')
+    return board.acquire('coinc',events=5000)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path/'session.trace')
+    raw = record(path,True)
+    assert numpy.array_equal(replay(path),raw)
+
+def test_missing_payloads(tmp_path):
+    path = str(tmp_path/'session.trace')
+    raw = record(path,False)
+    with pytest.raises(RuntimeError):
+        replay(path)
+    replayed = replay(path,missing_payloads=True)
+    assert replayed.size == raw.size and not replayed.any()
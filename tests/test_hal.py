@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import threading
+import numpy
+import pytest
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+import pipet
+from pipet import hal
+from pipet.pnpparse import raw2evt
+
+class FailingFrontPanel(pipet.SimulatedFrontPanel):
+    def ReadFromBlockPipeOut(self,ep,bsize,buf):
+        raise IOError('usb gone')
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(hal.time,'sleep',lambda s: None)
+
+def make_board(serial,seed=0,frontpanel=pipet.SimulatedFrontPanel):
+    board = pipet.pipet(serial=serial,frontpanel=frontpanel(serial=serial,seed=seed))
+    board.init('nofile.bit')
+    return board
+
+def test_acquire():
+    board = make_board('A1')
+    validator = pipet.EventValidator()
+    raw = board.acquire('coinc',events=5000,validator=validator)
+    assert raw.size == 5000*10
+    assert raw2evt(raw).size == 5000
+    assert (validator.gaps, validator.lost_events, validator.signature_errors) == (0, 0, 0)
+
+def test_serial_mismatch():
+    with pytest.raises(RuntimeError):
+        pipet.pipet(serial='X',frontpanel=pipet.SimulatedFrontPanel(serial='Y')).init('nofile.bit')
+
+def test_multi_acquisition(tmp_path):
+    boards = [make_board(s,i) for i,s in enumerate(['A1','B2'])]
+    path = str(tmp_path/'merged.dat')
+    summary = pipet.MultiAcquisition(boards).run(path,mode='coinc',events=8000)
+    raw = pipet.split_merged(path)
+    assert sorted(raw) == ['A1','B2']
+    for tag in raw:
+        assert raw[tag].size == 8000*10
+        assert summary[tag]['bytes'] == raw[tag].nbytes
+        assert pipet.EventValidator().update(raw[tag]).gaps == 0
+
+def run_in_thread(fn,timeout=60):
+    result = {}
+    def target():
+        try:
+            fn()
+        except Exception as e:
+            result['error'] = e
+    t = threading.Thread(target=target)
+    t.daemon = True
+    t.start()
+    t.join(timeout)
+    assert not t.is_alive(), 'acquisition hung'
+    assert not [i for i in threading.enumerate() if i.name.startswith('pipet-')], 'workers left running'
+    return result.get('error')
+
+def test_multi_acquisition_failing_board(tmp_path):
+    boards = [make_board('A1'), make_board('BAD',frontpanel=FailingFrontPanel)]
+    error = run_in_thread(lambda: pipet.MultiAcquisition(boards).run(str(tmp_path/'merged.dat'),events=200000))
+    assert isinstance(error,IOError) and 'usb gone' in str(error)
+
+@pytest.mark.skipif(not os.path.exists('/dev/full'),reason='needs /dev/full')
+def test_multi_acquisition_failing_writer():
+    boards = [make_board(s,i) for i,s in enumerate(['A1','B2'])]
+    error = run_in_thread(lambda: pipet.MultiAcquisition(boards).run('/dev/full',mode='coinc',events=200000))
+    assert isinstance(error,(IOError,OSError))
+
+def test_delay_scan(tmp_path):
+    board = pipet.pipet(frontpanel=pipet.SimulatedFrontPanel(timing_offset=13,timing_sigma=6,seed=0))
+    board.init('nofile.bit')
+    path = str(tmp_path/'scan.txt')
+    for i in range(2):
+        scan = board.delay_scan(range(-64,65,16),fine_span=4,path=path)
+        assert abs(scan.result['offset']-13) < 3
+    with open(path) as f:
+        lines = f.readlines()
+    assert lines[0].startswith('# steps')
+    fits = [l for l in lines if l.startswith('# fit')]
+    assert len(fits) == 2 and 'offset %s'%scan.result['offset'] in fits[-1]
+    assert len(lines) == 1+2*len(scan.points)+2
+
+def test_delay_scan_header_on_first_point(tmp_path):
+    board = make_board('A1')
+    path = str(tmp_path/'scan.txt')
+    pipet.DelayScan(board,path=path)
+    assert not os.path.exists(path)
+
+class CountingFrontPanel(pipet.SimulatedFrontPanel):
+    def __init__(self,*args,**kwargs):
+        pipet.SimulatedFrontPanel.__init__(self,*args,**kwargs)
+        self.wire_in_updates = 0
+    def UpdateWireIns(self):
+        self.wire_in_updates += 1
+        return pipet.SimulatedFrontPanel.UpdateWireIns(self)
+
+def bare_board():
+    board = pipet.pipet(frontpanel=CountingFrontPanel())
+    board.fpga.xem = board.fpga.frontpanel
+    board.set_bus_verbosity(False)
+    return board
+
+def test_planned_state_matches_per_bit_writes():
+    per_bit = bare_board()
+    for daq in [per_bit.daq1,per_bit.daq2]:
+        daq.oe_all()
+    for v in [0,1]:
+        per_bit.daq1.nclr(v)
+        per_bit.daq2.nclr(v)
+    for b,i in [('x',16),('y',16),('x',18),('y',18),('x',20),('x',20),('x',21),('y',21)]:
+        per_bit.bus_array[b].oe(i,1)
+    for b,i in [('x',16),('y',16),('x',18),('y',18)]:
+        per_bit.bus_array[b].write(i,0)
+    for name,value in [('oscillator1_on',1),('oscillator2_on',1),('delay_a',0),('delay_b',7),
+                       ('acquisition_on',0),('acquisition_on',1),('acquisition_mode','coinc')]:
+        per_bit.fpga.SetWireIn(**hal.C_CONFIGURATION_MAP[name](value))
+    planned = bare_board()
+    planned.init_buses()
+    planned.reset_daqs(0)
+    planned.oe_init()
+    planned.osc(1)
+    planned.set_delay(-7)
+    planned.start_acquisition('coinc',0)
+    assert planned.fpga.xem.wire_in == per_bit.fpga.xem.wire_in
+    assert planned.fpga.xem.wire_in_updates < per_bit.fpga.xem.wire_in_updates//4
+
+def test_plan_conflict(monkeypatch):
+    monkeypatch.setitem(hal.C_CONFIGURATION_MAP,'osc_and_acq',lambda x: {'ep': 0x00, 'value': 0x0, 'mask': 0x5})
+    with pytest.raises(RuntimeError):
+        hal.compile_plan({'oscillator1_on': 1, 'osc_and_acq': 0},cache=False)
+    assert hal.compile_plan({'oscillator1_on': 0, 'osc_and_acq': 0},cache=False) == ((0x00,0x0,0x5),)
+
+def test_plan_cache(monkeypatch):
+    monkeypatch.setattr(hal,'C_PLAN_CACHE',{})
+    state = {'delay_a': 3, 'delay_b': 0, ('x','oe',16): 1}
+    plan = hal.compile_plan(state)
+    assert len(hal.C_PLAN_CACHE) == 1
+    assert hal.compile_plan(dict(state)) is plan
+    assert hal.compile_plan(state,cache=False) == plan
+    assert len(hal.C_PLAN_CACHE) == 1
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+from pipet.pnpparse import single_type, event_type
+from pipet.lor import crystal_index, LORHistogram
+
+def make_events(n,seed=0):
+    rng = numpy.random.RandomState(seed)
+    evt = numpy.zeros(n,dtype=event_type)
+    for j in ['a','b']:
+        for c in ['xa','xb','ya','yb']:
+            evt[j][c] = rng.randint(1,4096,size=n)
+        evt[j]['dco'] = rng.rand(n) < 0.2
+    return evt
+
+def test_crystal_index_no_position():
+    sng = numpy.zeros(4,dtype=single_type)
+    sng['xa'], sng['xb'], sng['ya'], sng['yb'] = 100, 100, 100, 100
+    sng[1]['xa'], sng[1]['xb'] = 0, 0 # no x signal
+    sng[2]['dip'] = 15 # dummy
+    sng[3]['xa'] = sng[3]['xb'] = sng[3]['ya'] = sng[3]['yb'] = 0
+    lut = numpy.arange(16).reshape(4,4)
+    for l in [(4,4),lut]:
+        assert list(crystal_index(sng,l)) == [10,-1,-1,-1]
+
+def test_dummy_singles_not_counted():
+    evt = make_events(100)
+    evt['a']['dip'][:10] = 15
+    evt['b']['xa'][10:20] = evt['b']['xb'][10:20] = 0
+    h = LORHistogram((4,4)).update(evt)
+    assert h.prompts().sum() + h.delayed().sum() == 80
+
+def test_dense_sparse_merge(tmp_path):
+    e1, e2 = make_events(1000,1), make_events(500,2)
+    ref = LORHistogram((8,8)).update(numpy.concatenate([e1,e2]))
+    for sparse in [False,True]:
+        for other_sparse in [False,True]:
+            h = LORHistogram((8,8),sparse=sparse).update(e1).merge(LORHistogram((8,8),sparse=other_sparse).update(e2))
+            assert numpy.array_equal(h.prompts(),ref.prompts())
+            assert numpy.array_equal(h.delayed(),ref.delayed())
+            assert h.events == 1500
+        path = str(tmp_path/('h%d.npz'%sparse))
+        h.save(path)
+        g = LORHistogram.load(path,(8,8))
+        assert g.sparse == sparse and g.events == h.events
+        assert numpy.array_equal(g.net(),ref.net())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+from pipet.pnpparse import convmap, single_type, sng2raw, raw2sng, raw2evt, evt2raw, raw2rows, write_rows, signature_mask
+
+def make_raw(events,seed=0,markers=None):
+    # well-formed raw words: random fields, signature bits from chk_vector;
+    # markers (one per event, shared by a and b) clear tb0 when given
+    rng = numpy.random.RandomState(seed)
+    sng = numpy.zeros(2*events,dtype=single_type)
+    for i in convmap[numpy.char.find(convmap['name'],'ck') != 0]:
+        sng[i['name']] = rng.randint(0,1<<int(i['len']),size=sng.size)
+    sng['dip'][sng['dip'] == 15] = 0
+    if markers is not None:
+        sng['mrk'] = numpy.repeat(markers,2)
+        sng['tb0'] = 0
+    return sng2raw(sng)
+
+def read_back(path):
+    return numpy.fromfile(str(path),dtype=numpy.uint16)
+
+def test_make_raw_is_well_formed():
+    assert not signature_mask(raw2sng(make_raw(1000),check=False)).any()
+
+def test_write_rows_matches_reencode(tmp_path):
+    raw = make_raw(1000)
+    idx = numpy.nonzero(numpy.arange(1000) % 3 != 1)[0]
+    write_rows(raw,idx,str(tmp_path/'rows.dat'),chunk_rows=64)
+    assert numpy.array_equal(read_back(tmp_path/'rows.dat'),evt2raw(raw2evt(raw,check=False)[idx]))
+
+def test_write_rows_copies_bad_words(tmp_path):
+    raw = make_raw(100)
+    raw[3*10+2] ^= 0x7<<13 # broken signature
+    raw[7*10+5] = (raw[7*10+5] & 0xf03f) | (15<<6) # dummy single b
+    idx = numpy.array([3,7,8])
+    write_rows(raw,idx,str(tmp_path/'rows.dat'))
+    assert numpy.array_equal(read_back(tmp_path/'rows.dat'),raw2rows(raw)[idx].ravel())
+
+def test_pedestal_skips_dummy_singles():
+    raw = make_raw(50)
+    raw[4*10+5] = (raw[4*10+5] & 0xf03f) | (15<<6) # dummy single b
+    ped = {'xa': numpy.array([100,200],dtype=numpy.uint16)}
+    sng = raw2evt(raw,check=False)
+    out = raw2evt(raw,pedestal=ped,check=False)
+    assert out['b']['xa'][4] == sng['b']['xa'][4]
+    expected = sng['a']['xa'] - numpy.minimum(sng['a']['xa'],100)
+    assert numpy.array_equal(out['a']['xa'],expected)
+
+def test_file_chunks_limits(tmp_path):
+    from pipet.pnpparse import file_chunks
+    raw = make_raw(100)
+    raw.tofile(str(tmp_path/'raw.dat'))
+    chunks = list(file_chunks(str(tmp_path/'raw.dat'),beg=20,max_words=500,chunk_events=7))
+    assert numpy.array_equal(numpy.concatenate(chunks),raw[200:500]) # -fe counts from the file start
+    chunks = list(file_chunks(str(tmp_path/'raw.dat'),beg=20,end=40,chunk_events=7))
+    assert numpy.array_equal(numpy.concatenate(chunks),raw[200:400])
+
+def test_subtract_pedestal_in_place():
+    import tracemalloc
+    from pipet.pnpparse import subtract_pedestal
+    rng = numpy.random.RandomState(0)
+    v = rng.randint(0,4096,size=1000000).astype(numpy.uint16)
+    valid = rng.rand(v.size) > 0.1
+    ped = numpy.array([1000,2000],dtype=numpy.uint16)
+    p = numpy.tile(ped,v.size//2)
+    expected = numpy.where(valid,v-numpy.minimum(v,p),v)
+    tracemalloc.start()
+    subtract_pedestal(v,ped,valid)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert numpy.array_equal(v,expected)
+    assert peak < v.nbytes//10 # no temporary copies of the channel
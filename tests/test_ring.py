@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+import pytest
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+pytestmark = pytest.mark.skipif(sys.version_info < (3,8),reason='needs multiprocessing.shared_memory')
+
+def test_subscriber_lag():
+    from pipet.ring import FramePublisher, FrameSubscriber
+    pub = FramePublisher(slots=4,slot_bytes=64)
+    try:
+        for i in range(50):
+            pub.publish(numpy.full(8,i,dtype=numpy.uint16))
+        latest = FrameSubscriber(pub.name)
+        oldest = FrameSubscriber(pub.name,start='oldest')
+        assert latest.lag == 0
+        assert [c['lag'] for c in pub.status()] == [0,50]
+        pub.publish(numpy.full(8,50,dtype=numpy.uint16))
+        seq, frame = latest.read(timeout=1)
+        assert seq == 51 and (frame == 50).all()
+        assert pub.status()[0]['lag'] == 0
+        seq, frame = oldest.read(timeout=1)
+        assert seq == 49 and oldest.overruns == 48
+        latest.close()
+        oldest.close()
+    finally:
+        pub.close()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+from pipet.pnpparse import single_type
+from pipet.sorter import sort_coincidences
+
+def make_singles(mrk,energy):
+    sng = numpy.zeros(len(mrk),dtype=single_type)
+    sng['mrk'] = mrk
+    sng['sum'] = energy
+    return sng
+
+def test_prompt_coincidences():
+    a = make_singles([10,50,5,40,3],500)
+    b = make_singles([10,50,5,40,3],500)
+    evt = sort_coincidences(a,b)
+    assert list(evt['a']['mrk']) == [10,50,5,40,3]
+
+def test_energy_gate_keeps_time_base():
+    a = make_singles([10,50,5,40,3],[500,500,100,100,500])
+    b = make_singles([10,50,5,40,3],500)
+    evt = sort_coincidences(a,b,energy=(400,600))
+    assert list(evt['a']['mrk']) == [10,50,3]
+    assert list(evt['b']['mrk']) == [10,50,3]
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+import os, sys
+import numpy
+import pytest
+this_path, this_file = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(this_path))
+from pipet.validator import EventValidator, DataLossError
+from test_pnpparse import make_raw
+
+def test_gaps_across_frames():
+    v = EventValidator()
+    v.update(make_raw(4,markers=[60,61,62,63]))
+    v.update(make_raw(3,markers=[0,4,5])) # wrap, then 3 lost
+    assert (v.gaps, v.repeats, v.lost_events, v.events) == (1, 0, 3, 7)
+
+def test_repeated_marker_is_not_a_loss():
+    v = EventValidator(max_lost=0)
+    v.update(make_raw(4,markers=[1,2,2,3]))
+    assert (v.gaps, v.repeats, v.lost_events) == (1, 1, 0)
+    with pytest.raises(DataLossError):
+        v.update(make_raw(2,markers=[10,11]))